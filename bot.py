@@ -3659,9 +3659,11 @@ async def handle_expense_photo(update: Update, context: ContextTypes.DEFAULT_TYP
         source_account = "Kaspi Gold" if detected_source == "kaspi" else "Оставил в кассе (на закупы)"
 
         # Сохраняем черновики в БД для веб-интерфейса
+        # (в отдельном потоке, чтобы запись не блокировала event loop бота)
         from database import get_database
         db = get_database()
-        db.save_expense_drafts(
+        await asyncio.to_thread(
+            db.save_expense_drafts,
             telegram_user_id=update.effective_user.id,
             items=items,
             source=source_db,
@@ -4009,11 +4011,12 @@ async def handle_supply_mode_start(update: Update, context: ContextTypes.DEFAULT
     telegram_user_id = update.effective_user.id
     db = get_database()
 
-    # Получаем pending расходы с типом supply
-    pending_supplies = db.get_pending_supply_items(telegram_user_id)
-
-    # Получаем уже созданные черновики поставок
-    supply_drafts = db.get_supply_drafts(telegram_user_id, status="pending")
+    # Получаем pending расходы с типом supply и уже созданные черновики поставок
+    # (в отдельных потоках, чтобы запросы не блокировали event loop бота и шли параллельно)
+    pending_supplies, supply_drafts = await asyncio.gather(
+        asyncio.to_thread(db.get_pending_supply_items, telegram_user_id),
+        asyncio.to_thread(db.get_supply_drafts, telegram_user_id, status="pending"),
+    )
 
     # Начинаем режим ввода поставок
     context.user_data['supply_input'] = {
@@ -4093,7 +4096,7 @@ async def handle_supply_callback(update: Update, context: ContextTypes.DEFAULT_T
 
         try:
             # Получаем черновик с позициями
-            draft = db.get_supply_draft_with_items(supply_draft_id)
+            draft = await asyncio.to_thread(db.get_supply_draft_with_items, supply_draft_id)
             if not draft:
                 await query.edit_message_text("❌ Черновик не найден")
                 return
@@ -4113,12 +4116,10 @@ async def handle_supply_callback(update: Update, context: ContextTypes.DEFAULT_T
                     'price': item['price_per_unit']
                 })
 
-            # Отмечаем черновик как обработанный
-            db.mark_supply_draft_processed(supply_draft_id)
-
-            # Если есть связанный расход - тоже отмечаем
-            if draft.get('linked_expense_draft_id'):
-                db.mark_drafts_processed([draft['linked_expense_draft_id']])
+            # Отмечаем черновик и связанный расход (если есть) как обработанные
+            await asyncio.to_thread(
+                db.mark_supply_draft_processed, supply_draft_id, draft.get('linked_expense_draft_id')
+            )
 
             await query.edit_message_text("✅ Передано в обработку поставки...")
 
@@ -4133,7 +4134,7 @@ async def handle_supply_callback(update: Update, context: ContextTypes.DEFAULT_T
     elif data.startswith("supply_delete:"):
         supply_draft_id = int(data.split(":")[1])
 
-        if db.delete_supply_draft(supply_draft_id):
+        if await asyncio.to_thread(db.delete_supply_draft, supply_draft_id):
             await query.edit_message_text("🗑️ Черновик поставки удалён")
         else:
             await query.edit_message_text("❌ Ошибка удаления черновика")
@@ -5934,6 +5935,16 @@ async def check_and_notify_missed_transactions(app: Application):
         logger.error(f"❌ Ошибка проверки пропущенных транзакций: {e}", exc_info=True)
 
 
+async def expire_subscriptions_job():
+    """Перевести просроченные подписки в статус 'expired'"""
+    try:
+        from database import get_database
+        db = get_database()
+        await asyncio.to_thread(db.expire_subscriptions)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при истечении подписок: {e}", exc_info=True)
+
+
 # Global reference to keep scheduler alive (prevent garbage collection)
 _app_scheduler = None
 
@@ -6051,6 +6062,17 @@ def setup_scheduler(app: Application):
 
         logger.info(f"✅ Запланирована еженедельная проверка цен для пользователя {telegram_user_id} в Пн 9:00 (Asia/Almaty)")
 
+    # Перевод просроченных подписок в статус 'expired' — раз в час
+    # (is_subscription_active только читает и сам статус не меняет)
+    scheduler.add_job(
+        expire_subscriptions_job,
+        trigger='interval',
+        hours=1,
+        id='expire_subscriptions',
+        name='Истечение подписок',
+        replace_existing=True
+    )
+
     # Напоминание о зарплатах (21:30) — убрано, зарплаты считает кассир через свою страницу
     # Сверка счетов (22:30) — убрано, сверка через сайт расходов
 
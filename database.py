@@ -1,9 +1,17 @@
 """Database management for multi-tenant bot - supports both SQLite and PostgreSQL"""
 import os
+import copy
+import json
+import time
+import itertools
+import queue
 import logging
+import functools
+import threading
+import weakref
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -14,7 +22,7 @@ DATABASE_URL = os.getenv("DATABASE_URL")  # Railway provides this for PostgreSQL
 if DATABASE_URL:
     # PostgreSQL on Railway
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
     from psycopg2 import pool
     DB_TYPE = "postgresql"
     logger.info("Using PostgreSQL database")
@@ -33,6 +41,608 @@ else:
     DB_POOL = None
     logger.info(f"Using SQLite database at {DATABASE_PATH}")
 
+# Bump whenever _init_db or a _migrate_* step changes the schema, so existing
+# databases run the (idempotent) initialization once more on next start
+SCHEMA_VERSION = 8
+
+# Per-connection SQLite tuning: fsync only at WAL checkpoints, temp tables in
+# memory, 64 MB page cache and 256 MB memory-mapped I/O
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Base schema per backend, applied in one call by _init_db. Columns added later
+# by migrations are created by the ALTERs that follow it.
+SQLITE_SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS users (
+    telegram_user_id INTEGER PRIMARY KEY,
+    poster_token TEXT NOT NULL,
+    poster_user_id TEXT NOT NULL,
+    poster_base_url TEXT NOT NULL,
+    subscription_status TEXT NOT NULL DEFAULT 'trial',
+    subscription_expires_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- Table for poster accounts (multi-account support)
+CREATE TABLE IF NOT EXISTS poster_accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    account_name TEXT NOT NULL,
+    poster_token TEXT NOT NULL,
+    poster_user_id TEXT NOT NULL,
+    poster_base_url TEXT NOT NULL,
+    is_primary INTEGER DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    UNIQUE(telegram_user_id, account_name),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Account lists (primary first) and the primary-account lookup
+DROP INDEX IF EXISTS idx_accounts_user;
+CREATE INDEX IF NOT EXISTS idx_accounts_user_primary
+ON poster_accounts(telegram_user_id, is_primary DESC, account_name);
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    telegram_user_id INTEGER PRIMARY KEY,
+    language TEXT DEFAULT 'ru',
+    timezone TEXT DEFAULT 'UTC+6',
+    notifications_enabled INTEGER DEFAULT 1,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id)
+);
+
+-- Table for ingredient aliases (multi-tenant)
+CREATE TABLE IF NOT EXISTS ingredient_aliases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    alias_text TEXT NOT NULL,
+    poster_item_id INTEGER NOT NULL,
+    poster_item_name TEXT NOT NULL,
+    source TEXT DEFAULT 'user',
+    notes TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, alias_text),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Alias lookups use the UNIQUE(telegram_user_id, alias_text) index
+DROP INDEX IF EXISTS idx_aliases_user_alias;
+
+-- Table for supplier aliases (ИП Федорова → Кока-Кола)
+CREATE TABLE IF NOT EXISTS supplier_aliases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    alias_text TEXT NOT NULL,
+    poster_supplier_id INTEGER NOT NULL,
+    poster_supplier_name TEXT NOT NULL,
+    notes TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, alias_text),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+DROP INDEX IF EXISTS idx_supplier_aliases_user_alias;
+
+-- Table for shipment templates (quick templates for recurring shipments)
+CREATE TABLE IF NOT EXISTS shipment_templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    template_name TEXT NOT NULL,
+    supplier_id INTEGER NOT NULL,
+    supplier_name TEXT NOT NULL,
+    account_id INTEGER NOT NULL,
+    account_name TEXT NOT NULL,
+    storage_id INTEGER DEFAULT 1,
+    items TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, template_name),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Template lookups use the UNIQUE(telegram_user_id, template_name) index
+DROP INDEX IF EXISTS idx_templates_user_name;
+
+-- Table for ingredient price history (for smart price monitoring)
+CREATE TABLE IF NOT EXISTS ingredient_price_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    ingredient_id INTEGER NOT NULL,
+    ingredient_name TEXT,
+    supplier_id INTEGER,
+    supplier_name TEXT,
+    date DATE NOT NULL,
+    price DECIMAL(10, 2) NOT NULL,
+    quantity DECIMAL(10, 3),
+    unit TEXT,
+    supply_id INTEGER,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Indexes for fast lookups
+CREATE INDEX IF NOT EXISTS idx_price_history_ingredient_date
+ON ingredient_price_history(telegram_user_id, ingredient_id, date);
+
+CREATE INDEX IF NOT EXISTS idx_price_history_supplier
+ON ingredient_price_history(telegram_user_id, supplier_id);
+
+-- Period reports (ABC analysis, price trends) scan one tenant's date range
+CREATE INDEX IF NOT EXISTS idx_price_history_user_date
+ON ingredient_price_history(telegram_user_id, date);
+
+-- Table for employees (for salary tracking with names)
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    employee_name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    last_mentioned_date TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, employee_name, role),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_employees_user_role
+ON employees(telegram_user_id, role);
+
+-- Table for expense drafts (черновики расходов для веб-интерфейса)
+CREATE TABLE IF NOT EXISTS expense_drafts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT NOT NULL,
+    expense_type TEXT NOT NULL DEFAULT 'transaction',
+    category TEXT,
+    source TEXT NOT NULL DEFAULT 'cash',
+    source_account TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    quantity REAL,
+    unit TEXT,
+    price_per_unit REAL,
+    account_id INTEGER,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TEXT,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Per-user draft lists filtered by status, newest first (no sort step)
+DROP INDEX IF EXISTS idx_expense_drafts_user_status;
+CREATE INDEX IF NOT EXISTS idx_expense_drafts_user_status_created
+ON expense_drafts(telegram_user_id, status, created_at DESC);
+
+-- Pending supply expenses offered for linking to invoices (get_pending_supply_items).
+-- SQLite's planner passes over a partial index here, so expense_type is a key column
+CREATE INDEX IF NOT EXISTS idx_expense_drafts_pending_supply
+ON expense_drafts(telegram_user_id, status, expense_type, created_at DESC);
+
+-- Table for shift reconciliation (сверка смены по источникам: cash/kaspi/halyk)
+CREATE TABLE IF NOT EXISTS shift_reconciliation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    source TEXT NOT NULL,
+    opening_balance REAL,
+    closing_balance REAL,
+    total_difference REAL,
+    notes TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT,
+    UNIQUE(telegram_user_id, date, source),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_shift_reconciliation_user_date
+ON shift_reconciliation(telegram_user_id, date);
+
+-- Table for shift closings (история закрытий смены)
+CREATE TABLE IF NOT EXISTS shift_closings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    wolt REAL DEFAULT 0,
+    halyk REAL DEFAULT 0,
+    kaspi REAL DEFAULT 0,
+    kaspi_cafe REAL DEFAULT 0,
+    cash_bills REAL DEFAULT 0,
+    cash_coins REAL DEFAULT 0,
+    shift_start REAL DEFAULT 0,
+    deposits REAL DEFAULT 0,
+    expenses REAL DEFAULT 0,
+    cash_to_leave REAL DEFAULT 15000,
+    poster_trade REAL DEFAULT 0,
+    poster_bonus REAL DEFAULT 0,
+    poster_card REAL DEFAULT 0,
+    poster_cash REAL DEFAULT 0,
+    transactions_count INTEGER DEFAULT 0,
+    fact_cashless REAL DEFAULT 0,
+    fact_total REAL DEFAULT 0,
+    fact_adjusted REAL DEFAULT 0,
+    poster_total REAL DEFAULT 0,
+    day_result REAL DEFAULT 0,
+    shift_left REAL DEFAULT 0,
+    collection REAL DEFAULT 0,
+    cashless_diff REAL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT,
+    UNIQUE(telegram_user_id, date),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_shift_closings_user_date
+ON shift_closings(telegram_user_id, date);
+
+-- Table for supply drafts (черновики поставок)
+CREATE TABLE IF NOT EXISTS supply_drafts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_user_id INTEGER NOT NULL,
+    supplier_name TEXT,
+    invoice_date TEXT,
+    total_sum REAL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    linked_expense_draft_id INTEGER,
+    ocr_text TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TEXT,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE,
+    FOREIGN KEY (linked_expense_draft_id) REFERENCES expense_drafts(id) ON DELETE SET NULL
+);
+
+-- Per-user supply draft lists filtered by status, newest first (no sort step)
+DROP INDEX IF EXISTS idx_supply_drafts_user_status;
+CREATE INDEX IF NOT EXISTS idx_supply_drafts_user_status_created
+ON supply_drafts(telegram_user_id, status, created_at DESC);
+
+-- Table for supply draft items (позиции в черновике поставки)
+CREATE TABLE IF NOT EXISTS supply_draft_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    supply_draft_id INTEGER NOT NULL,
+    item_name TEXT NOT NULL,
+    quantity REAL NOT NULL DEFAULT 1,
+    unit TEXT DEFAULT 'шт',
+    price_per_unit REAL NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,
+    poster_ingredient_id INTEGER,
+    poster_ingredient_name TEXT,
+    FOREIGN KEY (supply_draft_id) REFERENCES supply_drafts(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_supply_draft_items_draft
+ON supply_draft_items(supply_draft_id);
+"""
+
+PG_SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS users (
+    telegram_user_id BIGINT PRIMARY KEY,
+    poster_token TEXT NOT NULL,
+    poster_user_id TEXT NOT NULL,
+    poster_base_url TEXT NOT NULL,
+    subscription_status TEXT NOT NULL DEFAULT 'trial',
+    subscription_expires_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+-- Table for poster accounts (multi-account support)
+CREATE TABLE IF NOT EXISTS poster_accounts (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    account_name TEXT NOT NULL,
+    poster_token TEXT NOT NULL,
+    poster_user_id TEXT NOT NULL,
+    poster_base_url TEXT NOT NULL,
+    is_primary BOOLEAN DEFAULT false,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    UNIQUE(telegram_user_id, account_name),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Account lists (primary first) and the primary-account lookup
+DROP INDEX IF EXISTS idx_accounts_user;
+CREATE INDEX IF NOT EXISTS idx_accounts_user_primary
+ON poster_accounts(telegram_user_id, is_primary DESC, account_name);
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    telegram_user_id BIGINT PRIMARY KEY,
+    language TEXT DEFAULT 'ru',
+    timezone TEXT DEFAULT 'UTC+6',
+    notifications_enabled INTEGER DEFAULT 1,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id)
+);
+
+-- Table for ingredient aliases (multi-tenant)
+CREATE TABLE IF NOT EXISTS ingredient_aliases (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    alias_text TEXT NOT NULL,
+    poster_item_id INTEGER NOT NULL,
+    poster_item_name TEXT NOT NULL,
+    source TEXT DEFAULT 'user',
+    notes TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, alias_text),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Alias lookups use the UNIQUE(telegram_user_id, alias_text) index
+DROP INDEX IF EXISTS idx_aliases_user_alias;
+
+-- Table for supplier aliases (ИП Федорова → Кока-Кола)
+CREATE TABLE IF NOT EXISTS supplier_aliases (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    alias_text TEXT NOT NULL,
+    poster_supplier_id INTEGER NOT NULL,
+    poster_supplier_name TEXT NOT NULL,
+    notes TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, alias_text),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+DROP INDEX IF EXISTS idx_supplier_aliases_user_alias;
+
+-- Table for shipment templates (quick templates for recurring shipments)
+CREATE TABLE IF NOT EXISTS shipment_templates (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    template_name TEXT NOT NULL,
+    supplier_id INTEGER NOT NULL,
+    supplier_name TEXT NOT NULL,
+    account_id INTEGER NOT NULL,
+    account_name TEXT NOT NULL,
+    storage_id INTEGER DEFAULT 1,
+    items JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, template_name),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Template lookups use the UNIQUE(telegram_user_id, template_name) index
+DROP INDEX IF EXISTS idx_templates_user_name;
+
+-- Table for ingredient price history (for smart price monitoring)
+CREATE TABLE IF NOT EXISTS ingredient_price_history (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    ingredient_id INTEGER NOT NULL,
+    ingredient_name TEXT,
+    supplier_id INTEGER,
+    supplier_name TEXT,
+    date DATE NOT NULL,
+    price DECIMAL(10, 2) NOT NULL,
+    quantity DECIMAL(10, 3),
+    unit TEXT,
+    supply_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Indexes for fast lookups
+CREATE INDEX IF NOT EXISTS idx_price_history_ingredient_date
+ON ingredient_price_history(telegram_user_id, ingredient_id, date);
+
+CREATE INDEX IF NOT EXISTS idx_price_history_supplier
+ON ingredient_price_history(telegram_user_id, supplier_id);
+
+-- Period reports (ABC analysis, price trends) scan one tenant's date range
+CREATE INDEX IF NOT EXISTS idx_price_history_user_date
+ON ingredient_price_history(telegram_user_id, date);
+
+-- Table for employees (for salary tracking with names)
+CREATE TABLE IF NOT EXISTS employees (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    employee_name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    last_mentioned_date DATE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(telegram_user_id, employee_name, role),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_employees_user_role
+ON employees(telegram_user_id, role);
+
+-- Table for expense drafts (черновики расходов для веб-интерфейса)
+CREATE TABLE IF NOT EXISTS expense_drafts (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    amount DECIMAL(12,2) NOT NULL,
+    description TEXT NOT NULL,
+    expense_type TEXT NOT NULL DEFAULT 'transaction',
+    category TEXT,
+    source TEXT NOT NULL DEFAULT 'cash',
+    source_account TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    quantity DECIMAL(10,3),
+    unit TEXT,
+    price_per_unit DECIMAL(12,2),
+    account_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+-- Per-user draft lists filtered by status, newest first (no sort step)
+DROP INDEX IF EXISTS idx_expense_drafts_user_status;
+CREATE INDEX IF NOT EXISTS idx_expense_drafts_user_status_created
+ON expense_drafts(telegram_user_id, status, created_at DESC);
+
+-- Pending supply expenses offered for linking to invoices (get_pending_supply_items)
+CREATE INDEX IF NOT EXISTS idx_expense_drafts_pending_supply
+ON expense_drafts(telegram_user_id, created_at DESC)
+WHERE status = 'pending' AND expense_type = 'supply';
+
+-- Table for shift reconciliation (сверка смены по источникам: cash/kaspi/halyk)
+CREATE TABLE IF NOT EXISTS shift_reconciliation (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    date DATE NOT NULL,
+    source TEXT NOT NULL,
+    opening_balance REAL,
+    closing_balance REAL,
+    total_difference REAL,
+    notes TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+    UNIQUE(telegram_user_id, date, source),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_shift_reconciliation_user_date
+ON shift_reconciliation(telegram_user_id, date);
+
+-- Table for shift closings (история закрытий смены)
+CREATE TABLE IF NOT EXISTS shift_closings (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    date DATE NOT NULL,
+    wolt REAL DEFAULT 0,
+    halyk REAL DEFAULT 0,
+    kaspi REAL DEFAULT 0,
+    kaspi_cafe REAL DEFAULT 0,
+    cash_bills REAL DEFAULT 0,
+    cash_coins REAL DEFAULT 0,
+    shift_start REAL DEFAULT 0,
+    deposits REAL DEFAULT 0,
+    expenses REAL DEFAULT 0,
+    cash_to_leave REAL DEFAULT 15000,
+    poster_trade REAL DEFAULT 0,
+    poster_bonus REAL DEFAULT 0,
+    poster_card REAL DEFAULT 0,
+    poster_cash REAL DEFAULT 0,
+    transactions_count INTEGER DEFAULT 0,
+    fact_cashless REAL DEFAULT 0,
+    fact_total REAL DEFAULT 0,
+    fact_adjusted REAL DEFAULT 0,
+    poster_total REAL DEFAULT 0,
+    day_result REAL DEFAULT 0,
+    shift_left REAL DEFAULT 0,
+    collection REAL DEFAULT 0,
+    cashless_diff REAL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+    UNIQUE(telegram_user_id, date),
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_shift_closings_user_date
+ON shift_closings(telegram_user_id, date);
+
+-- Table for supply drafts (черновики поставок)
+CREATE TABLE IF NOT EXISTS supply_drafts (
+    id SERIAL PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    supplier_name TEXT,
+    invoice_date DATE,
+    total_sum DECIMAL(12,2),
+    status TEXT NOT NULL DEFAULT 'pending',
+    linked_expense_draft_id INTEGER,
+    ocr_text TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE,
+    FOREIGN KEY (linked_expense_draft_id) REFERENCES expense_drafts(id) ON DELETE SET NULL
+);
+
+-- Per-user supply draft lists filtered by status, newest first (no sort step)
+DROP INDEX IF EXISTS idx_supply_drafts_user_status;
+CREATE INDEX IF NOT EXISTS idx_supply_drafts_user_status_created
+ON supply_drafts(telegram_user_id, status, created_at DESC);
+
+-- Table for supply draft items (позиции в черновике поставки)
+CREATE TABLE IF NOT EXISTS supply_draft_items (
+    id SERIAL PRIMARY KEY,
+    supply_draft_id INTEGER NOT NULL,
+    item_name TEXT NOT NULL,
+    quantity DECIMAL(10,3) NOT NULL DEFAULT 1,
+    unit TEXT DEFAULT 'шт',
+    price_per_unit DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total DECIMAL(12,2) NOT NULL DEFAULT 0,
+    poster_ingredient_id INTEGER,
+    poster_ingredient_name TEXT,
+    FOREIGN KEY (supply_draft_id) REFERENCES supply_drafts(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_supply_draft_items_draft
+ON supply_draft_items(supply_draft_id);
+"""
+
+SCHEMA_DDL = SQLITE_SCHEMA_DDL if DB_TYPE == "sqlite" else PG_SCHEMA_DDL
+
+# Names of server-side prepared statements per PostgreSQL connection. Prepared
+# statements live as long as the session, so pooled connections keep theirs.
+_PG_PREPARED = weakref.WeakKeyDictionary()
+
+
+# _q adapts a query written with '?' placeholders to the active backend, so a
+# method keeps one SQL string instead of a per-backend copy. The backend is
+# fixed at import, so the choice is made here rather than on every call.
+if DB_TYPE == "sqlite":
+    def _q(sql: str) -> str:
+        return sql
+else:
+    @functools.lru_cache(maxsize=1024)
+    def _q(sql: str) -> str:
+        # Literal '%' (e.g. in LIKE patterns) is escaped for psycopg2
+        return sql.replace("%", "%%").replace("?", "%s")
+
+
+# Tests a column against an id list bound as ONE parameter (see _id_list),
+# so the SQL text is the same whatever the list length
+_IN_ID_LIST = "IN (SELECT value FROM json_each(?))" if DB_TYPE == "sqlite" else "= ANY(?::int[])"
+
+
+def _id_list(ids) -> object:
+    """Bind value for _IN_ID_LIST: a JSON array on SQLite, a Python list (int[]) on PostgreSQL"""
+    ids = [int(i) for i in ids]
+    return json.dumps(ids) if DB_TYPE == "sqlite" else ids
+
+
+def _dict_rows(rows: list) -> list:
+    """Return fetched rows as dicts.
+
+    psycopg2's RealDictRow already is a dict, so only sqlite3.Row gets copied.
+    """
+    if DB_TYPE == "sqlite":
+        return [dict(row) for row in rows]
+    return rows
+
+
+@functools.lru_cache(maxsize=512)
+def _update_sql(table: str, fields: tuple, where: str) -> str:
+    """UPDATE statement for a sorted tuple of column names.
+
+    Callers sort their kwargs first, so the same set of columns always yields
+    the same SQL text (one entry in the statement caches) whatever order it
+    was passed in.
+    """
+    return f"UPDATE {table} SET {', '.join(f'{k} = ?' for k in fields)} WHERE {where}"
+
+# supply_drafts columns the app reads. ocr_text is write-only (kept for
+# debugging) and is the one large field, so list reads leave it out
+_SUPPLY_DRAFT_COLUMNS = """
+    id, telegram_user_id, supplier_name, supplier_id, invoice_date, total_sum,
+    status, linked_expense_draft_id, account_id, source, created_at, processed_at
+"""
+
+# All expense_drafts columns, listed explicitly: a prepared "SELECT *" fails
+# with "cached plan must not change result type" once a column is added
+_EXPENSE_DRAFT_COLUMNS = """
+    id, telegram_user_id, amount, description, expense_type, category, source,
+    source_account, status, quantity, unit, price_per_unit, account_id,
+    created_at, processed_at, poster_account_id, completion_status,
+    poster_transaction_id, is_income, poster_amount
+"""
+
 
 class _ManagedConnection:
     """Connection wrapper that ensures cleanup even if conn.close() is forgotten.
@@ -83,36 +693,147 @@ class _ManagedConnection:
         self._conn.row_factory = value
 
 
+class _SQLiteConnectionPool:
+    """Small pool of tuned sqlite3 connections with psycopg2-style getconn/putconn.
+
+    Reusing connections keeps SQLite's page cache warm between calls.
+    Connections are created lazily and handed to one thread at a time.
+    """
+
+    def __init__(self, db_path, maxconn: int = 8):
+        self._db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=maxconn)
+        self._wal_enabled = False
+
+    def _connect(self):
+        # Keep more compiled statements per connection than the default 128
+        conn = sqlite3.connect(self._db_path, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        if not self._wal_enabled:
+            # journal_mode is persistent in the database file, set it once per process
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._wal_enabled = True
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def getconn(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def putconn(self, conn):
+        # Don't hand uncommitted work or a swapped row_factory to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        if conn.row_factory is not sqlite3.Row:
+            conn.row_factory = sqlite3.Row
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            # Let SQLite refresh planner stats from what this connection has seen
+            conn.execute("PRAGMA optimize")
+            conn.close()
+
+
+# Cached "no row" marker, so a miss can be told apart from an absent entry
+_MISSING = object()
+
+
+class _TTLCache:
+    """Process-local cache for hot lookups, invalidated by the write methods.
+
+    A fetch records `generation` before querying and passes it to set(): if an
+    invalidation happened in between, the (possibly stale) row isn't stored.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 4096):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, generation: int = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if len(self._data) >= self._maxsize:
+                # Drop the oldest entry (dicts keep insertion order)
+                self._data.pop(next(iter(self._data)), None)
+            self._data[key] = (time.monotonic() + self._ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def invalidate_group(self, group):
+        """Drop every (group, ...) key, e.g. all entries of one user"""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._data if key[0] == group]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
 class UserDatabase:
     """Database for managing user accounts"""
     DB_TYPE = DB_TYPE
 
     def __init__(self):
+        # users rows are read on every bot update and web request
+        self._user_cache = _TTLCache(ttl=60)
+        # Parsed shipment templates, keyed by (telegram_user_id, template_name)
+        self._template_cache = _TTLCache(ttl=300)
+        # Supplier alias resolutions, keyed by (telegram_user_id, normalized text)
+        self._supplier_alias_cache = _TTLCache(ttl=300)
+        # Drafts by id, re-read several times while one is being edited.
+        # A supply draft entry includes its items
+        self._expense_draft_cache = _TTLCache(ttl=60)
+        self._supply_draft_cache = _TTLCache(ttl=60)
+        # Users known to have no pending supply expenses (the usual case).
+        # Only new or edited expense drafts can add one, and they drop the entry
+        self._no_pending_supply_cache = _TTLCache(ttl=300)
+
+        # Pick the backend once; _get_connection is called for every query.
+        # It returns a pooled connection, given back to the pool on close()
+        # or when garbage collected
         if DB_TYPE == "sqlite":
             from config import DATABASE_PATH
             self.db_path = DATABASE_PATH
+            self._sqlite_pool = _SQLiteConnectionPool(self.db_path)
+            self._get_connection = self._get_sqlite_connection
         else:
             self.db_url = DATABASE_URL
+            self._get_connection = self._get_pg_connection
 
         self._init_db()
 
-    def _get_connection(self):
-        """Get managed database connection. Auto-closes when garbage collected."""
-        if DB_TYPE == "sqlite":
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return _ManagedConnection(conn)
-        else:
-            # PostgreSQL
-            if DB_POOL:
-                try:
-                    conn = DB_POOL.getconn()
-                    return _ManagedConnection(conn, pool=DB_POOL)
-                except Exception as e:
-                    logger.error(f"Pool error: {e}. Falling back to standard connection.")
-                    return _ManagedConnection(psycopg2.connect(self.db_url))
-            else:
+    def _get_sqlite_connection(self):
+        return _ManagedConnection(self._sqlite_pool.getconn(), pool=self._sqlite_pool)
+
+    def _get_pg_connection(self):
+        if DB_POOL:
+            try:
+                conn = DB_POOL.getconn()
+                return _ManagedConnection(conn, pool=DB_POOL)
+            except Exception as e:
+                logger.error(f"Pool error: {e}. Falling back to standard connection.")
                 return _ManagedConnection(psycopg2.connect(self.db_url))
+        else:
+            return _ManagedConnection(psycopg2.connect(self.db_url))
 
     def _init_db(self):
         """Initialize database with tables"""
@@ -121,689 +842,46 @@ class UserDatabase:
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
         conn = self._get_connection()
-        cursor = conn.cursor()
-
-        if DB_TYPE == "sqlite":
-            # SQLite syntax
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_user_id INTEGER PRIMARY KEY,
-                    poster_token TEXT NOT NULL,
-                    poster_user_id TEXT NOT NULL,
-                    poster_base_url TEXT NOT NULL,
-                    subscription_status TEXT NOT NULL DEFAULT 'trial',
-                    subscription_expires_at TEXT,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL
-                )
-            """)
 
-            # Table for poster accounts (multi-account support)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS poster_accounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    account_name TEXT NOT NULL,
-                    poster_token TEXT NOT NULL,
-                    poster_user_id TEXT NOT NULL,
-                    poster_base_url TEXT NOT NULL,
-                    is_primary INTEGER DEFAULT 0,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    UNIQUE(telegram_user_id, account_name),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_accounts_user
-                ON poster_accounts(telegram_user_id)
-            """)
-
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    telegram_user_id INTEGER PRIMARY KEY,
-                    language TEXT DEFAULT 'ru',
-                    timezone TEXT DEFAULT 'UTC+6',
-                    notifications_enabled INTEGER DEFAULT 1,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id)
-                )
-            """)
-
-            # Table for ingredient aliases (multi-tenant)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ingredient_aliases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    alias_text TEXT NOT NULL,
-                    poster_item_id INTEGER NOT NULL,
-                    poster_item_name TEXT NOT NULL,
-                    source TEXT DEFAULT 'user',
-                    notes TEXT,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, alias_text),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Index for fast alias lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_aliases_user_alias
-                ON ingredient_aliases(telegram_user_id, alias_text)
-            """)
-
-            # Table for supplier aliases (ИП Федорова → Кока-Кола)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supplier_aliases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    alias_text TEXT NOT NULL,
-                    poster_supplier_id INTEGER NOT NULL,
-                    poster_supplier_name TEXT NOT NULL,
-                    notes TEXT,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, alias_text),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supplier_aliases_user_alias
-                ON supplier_aliases(telegram_user_id, alias_text)
-            """)
-
-            # Table for shipment templates (quick templates for recurring shipments)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shipment_templates (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    template_name TEXT NOT NULL,
-                    supplier_id INTEGER NOT NULL,
-                    supplier_name TEXT NOT NULL,
-                    account_id INTEGER NOT NULL,
-                    account_name TEXT NOT NULL,
-                    storage_id INTEGER DEFAULT 1,
-                    items TEXT NOT NULL,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, template_name),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Index for fast template lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_templates_user_name
-                ON shipment_templates(telegram_user_id, template_name)
-            """)
-
-            # Table for ingredient price history (for smart price monitoring)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ingredient_price_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    ingredient_id INTEGER NOT NULL,
-                    ingredient_name TEXT,
-                    supplier_id INTEGER,
-                    supplier_name TEXT,
-                    date DATE NOT NULL,
-                    price DECIMAL(10, 2) NOT NULL,
-                    quantity DECIMAL(10, 3),
-                    unit TEXT,
-                    supply_id INTEGER,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Indexes for fast lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_price_history_ingredient_date
-                ON ingredient_price_history(telegram_user_id, ingredient_id, date)
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_price_history_supplier
-                ON ingredient_price_history(telegram_user_id, supplier_id)
-            """)
-
-            # Table for employees (for salary tracking with names)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS employees (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    employee_name TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    last_mentioned_date TEXT,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, employee_name, role),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_employees_user_role
-                ON employees(telegram_user_id, role)
-            """)
-
-            # Table for expense drafts (черновики расходов для веб-интерфейса)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS expense_drafts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    amount REAL NOT NULL,
-                    description TEXT NOT NULL,
-                    expense_type TEXT NOT NULL DEFAULT 'transaction',
-                    category TEXT,
-                    source TEXT NOT NULL DEFAULT 'cash',
-                    source_account TEXT,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    quantity REAL,
-                    unit TEXT,
-                    price_per_unit REAL,
-                    account_id INTEGER,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TEXT,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_expense_drafts_user_status
-                ON expense_drafts(telegram_user_id, status)
-            """)
-
-            # Migration: add account_id column if not exists
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN account_id INTEGER")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_account_id column if not exists (for multi-account support: PizzBurg, PizzBurg Cafe)
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN poster_account_id INTEGER")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add completion_status column for tracking expense completion
-            # Values: 'pending' (not done), 'partial' (in Poster but not paid), 'completed' (fully done)
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN completion_status TEXT DEFAULT 'pending'")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_transaction_id column for linking drafts to Poster transactions
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN poster_transaction_id TEXT")
-            except Exception:
-                pass  # Column already exists
-
-            # Index for fast lookup during sync (poster_transaction_id used in O(n) scan)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_expense_drafts_poster_txn
-                ON expense_drafts(poster_transaction_id)
-            """)
-
-            # Migration: add is_income column for income transactions (доходы, например продажа масла)
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN is_income INTEGER DEFAULT 0")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_amount column for tracking Poster's current amount
-            # Used to detect mismatches when user edits amount on website vs Poster
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN poster_amount REAL")
-            except Exception:
-                pass  # Column already exists
-
-            # Table for shift reconciliation (сверка смены по источникам: cash/kaspi/halyk)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shift_reconciliation (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    source TEXT NOT NULL,
-                    opening_balance REAL,
-                    closing_balance REAL,
-                    total_difference REAL,
-                    notes TEXT,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT,
-                    UNIQUE(telegram_user_id, date, source),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_shift_reconciliation_user_date
-                ON shift_reconciliation(telegram_user_id, date)
-            """)
-
-            # Table for shift closings (история закрытий смены)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shift_closings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    wolt REAL DEFAULT 0,
-                    halyk REAL DEFAULT 0,
-                    kaspi REAL DEFAULT 0,
-                    kaspi_cafe REAL DEFAULT 0,
-                    cash_bills REAL DEFAULT 0,
-                    cash_coins REAL DEFAULT 0,
-                    shift_start REAL DEFAULT 0,
-                    deposits REAL DEFAULT 0,
-                    expenses REAL DEFAULT 0,
-                    cash_to_leave REAL DEFAULT 15000,
-                    poster_trade REAL DEFAULT 0,
-                    poster_bonus REAL DEFAULT 0,
-                    poster_card REAL DEFAULT 0,
-                    poster_cash REAL DEFAULT 0,
-                    transactions_count INTEGER DEFAULT 0,
-                    fact_cashless REAL DEFAULT 0,
-                    fact_total REAL DEFAULT 0,
-                    fact_adjusted REAL DEFAULT 0,
-                    poster_total REAL DEFAULT 0,
-                    day_result REAL DEFAULT 0,
-                    shift_left REAL DEFAULT 0,
-                    collection REAL DEFAULT 0,
-                    cashless_diff REAL DEFAULT 0,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT,
-                    UNIQUE(telegram_user_id, date),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_shift_closings_user_date
-                ON shift_closings(telegram_user_id, date)
-            """)
-
-            # Table for supply drafts (черновики поставок)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supply_drafts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id INTEGER NOT NULL,
-                    supplier_name TEXT,
-                    invoice_date TEXT,
-                    total_sum REAL,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    linked_expense_draft_id INTEGER,
-                    ocr_text TEXT,
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TEXT,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE,
-                    FOREIGN KEY (linked_expense_draft_id) REFERENCES expense_drafts(id) ON DELETE SET NULL
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supply_drafts_user_status
-                ON supply_drafts(telegram_user_id, status)
-            """)
+        stored_version = self._get_schema_version(conn)
+        if stored_version >= SCHEMA_VERSION:
+            conn.close()
+            logger.info(f"✅ Database schema is up to date (version {SCHEMA_VERSION})")
+            return
 
-            # Table for supply draft items (позиции в черновике поставки)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supply_draft_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    supply_draft_id INTEGER NOT NULL,
-                    item_name TEXT NOT NULL,
-                    quantity REAL NOT NULL DEFAULT 1,
-                    unit TEXT DEFAULT 'шт',
-                    price_per_unit REAL NOT NULL DEFAULT 0,
-                    total REAL NOT NULL DEFAULT 0,
-                    poster_ingredient_id INTEGER,
-                    poster_ingredient_name TEXT,
-                    FOREIGN KEY (supply_draft_id) REFERENCES supply_drafts(id) ON DELETE CASCADE
-                )
-            """)
+        cursor = conn.cursor()
 
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supply_draft_items_draft
-                ON supply_draft_items(supply_draft_id)
-            """)
+        if DB_TYPE == "sqlite":
+            # All CREATEs go through one executescript() call. The script opens the
+            # transaction that the ALTERs below join, so the schema still lands in
+            # a single commit (sqlite3 would otherwise autocommit each DDL statement)
+            cursor.executescript("BEGIN;\n" + SCHEMA_DDL)
         else:
-            # PostgreSQL syntax
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_user_id BIGINT PRIMARY KEY,
-                    poster_token TEXT NOT NULL,
-                    poster_user_id TEXT NOT NULL,
-                    poster_base_url TEXT NOT NULL,
-                    subscription_status TEXT NOT NULL DEFAULT 'trial',
-                    subscription_expires_at TIMESTAMP,
-                    created_at TIMESTAMP NOT NULL,
-                    updated_at TIMESTAMP NOT NULL
-                )
-            """)
-
-            # Table for poster accounts (multi-account support)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS poster_accounts (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    account_name TEXT NOT NULL,
-                    poster_token TEXT NOT NULL,
-                    poster_user_id TEXT NOT NULL,
-                    poster_base_url TEXT NOT NULL,
-                    is_primary BOOLEAN DEFAULT false,
-                    created_at TIMESTAMP NOT NULL,
-                    updated_at TIMESTAMP NOT NULL,
-                    UNIQUE(telegram_user_id, account_name),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_accounts_user
-                ON poster_accounts(telegram_user_id)
-            """)
-
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    telegram_user_id BIGINT PRIMARY KEY,
-                    language TEXT DEFAULT 'ru',
-                    timezone TEXT DEFAULT 'UTC+6',
-                    notifications_enabled INTEGER DEFAULT 1,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id)
-                )
-            """)
-
-            # Table for ingredient aliases (multi-tenant)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ingredient_aliases (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    alias_text TEXT NOT NULL,
-                    poster_item_id INTEGER NOT NULL,
-                    poster_item_name TEXT NOT NULL,
-                    source TEXT DEFAULT 'user',
-                    notes TEXT,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, alias_text),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Index for fast alias lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_aliases_user_alias
-                ON ingredient_aliases(telegram_user_id, alias_text)
-            """)
-
-            # Table for supplier aliases (ИП Федорова → Кока-Кола)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supplier_aliases (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    alias_text TEXT NOT NULL,
-                    poster_supplier_id INTEGER NOT NULL,
-                    poster_supplier_name TEXT NOT NULL,
-                    notes TEXT,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, alias_text),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supplier_aliases_user_alias
-                ON supplier_aliases(telegram_user_id, alias_text)
-            """)
-
-            # Table for shipment templates (quick templates for recurring shipments)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shipment_templates (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    template_name TEXT NOT NULL,
-                    supplier_id INTEGER NOT NULL,
-                    supplier_name TEXT NOT NULL,
-                    account_id INTEGER NOT NULL,
-                    account_name TEXT NOT NULL,
-                    storage_id INTEGER DEFAULT 1,
-                    items TEXT NOT NULL,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, template_name),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Index for fast template lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_templates_user_name
-                ON shipment_templates(telegram_user_id, template_name)
-            """)
-
-            # Table for ingredient price history (for smart price monitoring)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ingredient_price_history (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    ingredient_id INTEGER NOT NULL,
-                    ingredient_name TEXT,
-                    supplier_id INTEGER,
-                    supplier_name TEXT,
-                    date DATE NOT NULL,
-                    price DECIMAL(10, 2) NOT NULL,
-                    quantity DECIMAL(10, 3),
-                    unit TEXT,
-                    supply_id INTEGER,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Indexes for fast lookups
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_price_history_ingredient_date
-                ON ingredient_price_history(telegram_user_id, ingredient_id, date)
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_price_history_supplier
-                ON ingredient_price_history(telegram_user_id, supplier_id)
-            """)
-
-            # Table for employees (for salary tracking with names)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS employees (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    employee_name TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    last_mentioned_date DATE,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(telegram_user_id, employee_name, role),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_employees_user_role
-                ON employees(telegram_user_id, role)
-            """)
-
-            # Table for expense drafts (черновики расходов для веб-интерфейса)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS expense_drafts (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    amount DECIMAL(12,2) NOT NULL,
-                    description TEXT NOT NULL,
-                    expense_type TEXT NOT NULL DEFAULT 'transaction',
-                    category TEXT,
-                    source TEXT NOT NULL DEFAULT 'cash',
-                    source_account TEXT,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    quantity DECIMAL(10,3),
-                    unit TEXT,
-                    price_per_unit DECIMAL(12,2),
-                    account_id INTEGER,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_expense_drafts_user_status
-                ON expense_drafts(telegram_user_id, status)
-            """)
-
-            # Migration: add account_id column if not exists
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS account_id INTEGER")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_account_id column if not exists (for multi-account support: PizzBurg, PizzBurg Cafe)
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS poster_account_id INTEGER")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add completion_status column for tracking expense completion
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS completion_status TEXT DEFAULT 'pending'")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_transaction_id column for linking drafts to Poster transactions
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS poster_transaction_id TEXT")
-            except Exception:
-                pass  # Column already exists
-
-            # Index for fast lookup during sync (poster_transaction_id used in O(n) scan)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_expense_drafts_poster_txn
-                ON expense_drafts(poster_transaction_id)
-            """)
-
-            # Migration: add is_income column for income transactions (доходы, например продажа масла)
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS is_income INTEGER DEFAULT 0")
-            except Exception:
-                pass  # Column already exists
-
-            # Migration: add poster_amount column for tracking Poster's current amount
-            # Used to detect mismatches when user edits amount on website vs Poster
-            try:
-                cursor.execute("ALTER TABLE expense_drafts ADD COLUMN IF NOT EXISTS poster_amount REAL")
-            except Exception:
-                pass  # Column already exists
-
-            # Table for shift reconciliation (сверка смены по источникам: cash/kaspi/halyk)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shift_reconciliation (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    date DATE NOT NULL,
-                    source TEXT NOT NULL,
-                    opening_balance REAL,
-                    closing_balance REAL,
-                    total_difference REAL,
-                    notes TEXT,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP,
-                    UNIQUE(telegram_user_id, date, source),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_shift_reconciliation_user_date
-                ON shift_reconciliation(telegram_user_id, date)
-            """)
-
-            # Table for shift closings (история закрытий смены)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shift_closings (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    date DATE NOT NULL,
-                    wolt REAL DEFAULT 0,
-                    halyk REAL DEFAULT 0,
-                    kaspi REAL DEFAULT 0,
-                    kaspi_cafe REAL DEFAULT 0,
-                    cash_bills REAL DEFAULT 0,
-                    cash_coins REAL DEFAULT 0,
-                    shift_start REAL DEFAULT 0,
-                    deposits REAL DEFAULT 0,
-                    expenses REAL DEFAULT 0,
-                    cash_to_leave REAL DEFAULT 15000,
-                    poster_trade REAL DEFAULT 0,
-                    poster_bonus REAL DEFAULT 0,
-                    poster_card REAL DEFAULT 0,
-                    poster_cash REAL DEFAULT 0,
-                    transactions_count INTEGER DEFAULT 0,
-                    fact_cashless REAL DEFAULT 0,
-                    fact_total REAL DEFAULT 0,
-                    fact_adjusted REAL DEFAULT 0,
-                    poster_total REAL DEFAULT 0,
-                    day_result REAL DEFAULT 0,
-                    shift_left REAL DEFAULT 0,
-                    collection REAL DEFAULT 0,
-                    cashless_diff REAL DEFAULT 0,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP,
-                    UNIQUE(telegram_user_id, date),
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_shift_closings_user_date
-                ON shift_closings(telegram_user_id, date)
-            """)
-
-            # Table for supply drafts (черновики поставок)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supply_drafts (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    supplier_name TEXT,
-                    invoice_date DATE,
-                    total_sum DECIMAL(12,2),
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    linked_expense_draft_id INTEGER,
-                    ocr_text TEXT,
-                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE,
-                    FOREIGN KEY (linked_expense_draft_id) REFERENCES expense_drafts(id) ON DELETE SET NULL
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supply_drafts_user_status
-                ON supply_drafts(telegram_user_id, status)
-            """)
-
-            # Table for supply draft items (позиции в черновике поставки)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS supply_draft_items (
-                    id SERIAL PRIMARY KEY,
-                    supply_draft_id INTEGER NOT NULL,
-                    item_name TEXT NOT NULL,
-                    quantity DECIMAL(10,3) NOT NULL DEFAULT 1,
-                    unit TEXT DEFAULT 'шт',
-                    price_per_unit DECIMAL(12,2) NOT NULL DEFAULT 0,
-                    total DECIMAL(12,2) NOT NULL DEFAULT 0,
-                    poster_ingredient_id INTEGER,
-                    poster_ingredient_name TEXT,
-                    FOREIGN KEY (supply_draft_id) REFERENCES supply_drafts(id) ON DELETE CASCADE
-                )
-            """)
-
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_supply_draft_items_draft
-                ON supply_draft_items(supply_draft_id)
-            """)
+            # One round trip: psycopg2 sends a parameterless multi-statement string as is
+            cursor.execute(SCHEMA_DDL)
+
+        # Columns added to expense_drafts after the first release. Only missing
+        # ones are ALTERed, so an up-to-date schema issues no DDL here. New
+        # columns also go into _EXPENSE_DRAFT_COLUMNS
+        self._add_missing_columns(cursor, "expense_drafts", [
+            ("account_id", "INTEGER"),
+            # multi-account support: PizzBurg, PizzBurg Cafe
+            ("poster_account_id", "INTEGER"),
+            # 'pending' (not done), 'partial' (in Poster but not paid), 'completed' (fully done)
+            ("completion_status", "TEXT DEFAULT 'pending'"),
+            # links drafts to Poster transactions
+            ("poster_transaction_id", "TEXT"),
+            # income transactions (доходы, например продажа масла)
+            ("is_income", "INTEGER DEFAULT 0"),
+            # Poster's current amount, to detect mismatches when user edits amount on website vs Poster
+            ("poster_amount", "REAL"),
+        ])
+
+        # Index for fast lookup during sync (poster_transaction_id used in O(n) scan)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expense_drafts_poster_txn
+            ON expense_drafts(poster_transaction_id)
+        """)
 
         conn.commit()
         conn.close()
@@ -813,48 +891,200 @@ class UserDatabase:
         else:
             logger.info(f"✅ PostgreSQL database initialized")
 
-        # Run migration to multi-account structure
-        self._migrate_to_multi_account()
+        # Each migration reports success; a failed one must rerun on next start
+        migrations_ok = True
+
+        # Run migration to multi-account structure (any database that already
+        # carries a schema version went through it)
+        if stored_version == 0:
+            migrations_ok &= self._migrate_to_multi_account()
 
         # Run migration to add poster_account_id to supply_draft_items
-        self._migrate_supply_items_add_account()
+        migrations_ok &= self._migrate_supply_items_add_account()
 
         # Run migration for cafe access tokens and shift_closings.poster_account_id
-        self._migrate_cafe_access()
+        migrations_ok &= self._migrate_cafe_access()
 
         # Run migration for cashier access tokens and cashier_shift_data
-        self._migrate_cashier_access()
+        migrations_ok &= self._migrate_cashier_access()
 
         # Run migration for web_users (auth system)
-        self._migrate_web_users()
+        migrations_ok &= self._migrate_web_users()
 
         # Run migration to fix shift_closings UNIQUE constraint (cafe + main same date)
-        self._migrate_shift_closings_fix_unique()
+        migrations_ok &= self._migrate_shift_closings_fix_unique()
 
         # Run migration to add salaries columns to shift_closings (cafe salaries)
-        self._migrate_cafe_salaries()
+        migrations_ok &= self._migrate_cafe_salaries()
 
         # Run migration to create daily_transactions_log table
-        self._migrate_daily_transactions_log()
+        migrations_ok &= self._migrate_daily_transactions_log()
 
         # Run migration to create daily_transactions_config table
-        self._migrate_daily_transactions_config()
+        migrations_ok &= self._migrate_daily_transactions_config()
 
         # Run migration to add packaging rules and habits
-        self._migrate_packaging_and_habits()
+        migrations_ok &= self._migrate_packaging_and_habits()
 
         # Run migration to add account_name to packaging rules and habits
-        self._migrate_packaging_and_habits_account()
+        migrations_ok &= self._migrate_packaging_and_habits_account()
 
         # Run migration for assistant chat history
-        self._migrate_assistant_chat()
+        migrations_ok &= self._migrate_assistant_chat()
 
         # Run migration for assistant memory
-        self._migrate_assistant_memory()
-        self._migrate_assistant_memory_versions()
+        migrations_ok &= self._migrate_assistant_memory()
+        migrations_ok &= self._migrate_assistant_memory_versions()
 
         # Run migration to add wedrink_sales column to shift_closings
-        self._migrate_shift_closings_wedrink()
+        migrations_ok &= self._migrate_shift_closings_wedrink()
+
+        # Run migration to store shipment_templates.items as JSONB (PostgreSQL)
+        migrations_ok &= self._migrate_shipment_templates_jsonb()
+
+        self._analyze_tables()
+        if migrations_ok:
+            self._set_schema_version(SCHEMA_VERSION)
+        else:
+            logger.warning("⚠️ Some migrations failed, schema version not updated; they will rerun on next start")
+
+    def _analyze_tables(self):
+        """Refresh planner statistics for the big tables after a schema change"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("ANALYZE expense_drafts")
+            cursor.execute("ANALYZE ingredient_price_history")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Failed to analyze tables: {e}")
+
+    def _get_table_columns(self, cursor, table: str) -> set:
+        """Get column names of a table"""
+        if DB_TYPE == "sqlite":
+            cursor.execute(f"PRAGMA table_info({table})")
+            return {row[1] for row in cursor.fetchall()}
+
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = %s
+        """, (table,))
+        return {row[0] for row in cursor.fetchall()}
+
+    def _add_missing_columns(self, cursor, table: str, columns: list) -> list:
+        """ALTER TABLE ADD COLUMN for each (name, definition) the table lacks. Returns added names"""
+        existing = self._get_table_columns(cursor, table)
+        added = []
+        for name, definition in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                added.append(name)
+        return added
+
+    def _dict_cursor(self, conn):
+        """Cursor whose rows convert with dict(row) on either backend"""
+        if DB_TYPE == "sqlite":
+            return conn.cursor()
+        return conn.cursor(cursor_factory=RealDictCursor)
+
+    @contextmanager
+    def _transaction(self, dict_rows: bool = False):
+        """Cursor on a pooled connection, committed once when the block exits.
+
+        If the block raises, the connection is rolled back and returned to the
+        pool, and the exception propagates for the caller to log.
+        """
+        conn = self._get_connection()
+        try:
+            yield self._dict_cursor(conn) if dict_rows else conn.cursor()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _execute(self, sql: str, params=(), fetch: str = None):
+        """Run one statement ('?' placeholders) in its own transaction.
+
+        fetch: None returns rowcount, 'one' / 'all' return fetched rows.
+        """
+        with self._transaction() as cursor:
+            cursor.execute(_q(sql), params)
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+            return cursor.rowcount
+
+    def _execute_prepared(self, cursor, name: str, sql: str, params: tuple):
+        """Run a hot PostgreSQL query as a prepared statement ($1..$n placeholders).
+
+        PREPAREd once per pooled connection, then only EXECUTEd, so the server
+        skips parsing and planning on repeat calls.
+        """
+        prepared = _PG_PREPARED.setdefault(cursor.connection, set())
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {sql}")
+            prepared.add(name)
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+    def _insert_many(self, cursor, table: str, columns: tuple, rows: list):
+        """Insert many rows at once: executemany on SQLite, paged multi-row VALUES on PostgreSQL"""
+        if not rows:
+            return
+
+        column_list = ", ".join(columns)
+        if DB_TYPE == "sqlite":
+            placeholders = ", ".join("?" * len(columns))
+            cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", rows)
+        else:
+            execute_values(cursor, f"INSERT INTO {table} ({column_list}) VALUES %s", rows, page_size=500)
+
+    def _get_schema_version(self, conn) -> int:
+        """Read stored schema version (0 for databases created before versioning)"""
+        cursor = conn.cursor()
+
+        if DB_TYPE == "sqlite":
+            cursor.execute("PRAGMA user_version")
+            return cursor.fetchone()[0]
+
+        try:
+            cursor.execute("SELECT value FROM schema_meta WHERE key = 'version'")
+            row = cursor.fetchone()
+            return int(row[0]) if row else 0
+        except Exception:
+            # schema_meta doesn't exist yet
+            conn.rollback()
+            return 0
+
+    def _set_schema_version(self, version: int):
+        """Record schema version after a successful initialization"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            if DB_TYPE == "sqlite":
+                # PRAGMA doesn't accept bound parameters
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+            else:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_meta (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL
+                    )
+                """)
+                cursor.execute("""
+                    INSERT INTO schema_meta (key, value) VALUES ('version', %s)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                """, (str(version),))
+
+            conn.commit()
+            conn.close()
+            logger.info(f"✅ Database schema version set to {version}")
+        except Exception as e:
+            logger.error(f"Failed to set schema version: {e}")
 
     def _migrate_shift_closings_fix_unique(self):
         """Fix UNIQUE constraint on shift_closings to include poster_account_id.
@@ -870,51 +1100,40 @@ class UserDatabase:
             if DB_TYPE == "sqlite":
                 # SQLite: can't ALTER DROP constraint, but we can create partial indexes.
                 # The old inline UNIQUE stays but we change code to not use ON CONFLICT on it.
-                try:
-                    cursor.execute("""
-                        CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_main_idx
-                        ON shift_closings (telegram_user_id, date)
-                        WHERE poster_account_id IS NULL
-                    """)
-                    cursor.execute("""
-                        CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_cafe_idx
-                        ON shift_closings (telegram_user_id, date, poster_account_id)
-                        WHERE poster_account_id IS NOT NULL
-                    """)
-                    logger.info("✅ shift_closings: created partial unique indexes (SQLite)")
-                except Exception:
-                    pass  # Indexes already exist
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_main_idx
+                    ON shift_closings (telegram_user_id, date)
+                    WHERE poster_account_id IS NULL
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_cafe_idx
+                    ON shift_closings (telegram_user_id, date, poster_account_id)
+                    WHERE poster_account_id IS NOT NULL
+                """)
             else:
                 # PostgreSQL: drop old constraint and create partial unique indexes
-                try:
-                    cursor.execute("""
-                        ALTER TABLE shift_closings
-                        DROP CONSTRAINT IF EXISTS shift_closings_telegram_user_id_date_key
-                    """)
-                    logger.info("✅ shift_closings: dropped old UNIQUE(telegram_user_id, date)")
-                except Exception:
-                    pass  # Constraint already dropped
-
-                try:
-                    cursor.execute("""
-                        CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_main_idx
-                        ON shift_closings (telegram_user_id, date)
-                        WHERE poster_account_id IS NULL
-                    """)
-                    cursor.execute("""
-                        CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_cafe_idx
-                        ON shift_closings (telegram_user_id, date, poster_account_id)
-                        WHERE poster_account_id IS NOT NULL
-                    """)
-                    logger.info("✅ shift_closings: created partial unique indexes (PostgreSQL)")
-                except Exception:
-                    pass  # Indexes already exist
+                cursor.execute("""
+                    ALTER TABLE shift_closings
+                    DROP CONSTRAINT IF EXISTS shift_closings_telegram_user_id_date_key
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_main_idx
+                    ON shift_closings (telegram_user_id, date)
+                    WHERE poster_account_id IS NULL
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS shift_closings_user_date_cafe_idx
+                    ON shift_closings (telegram_user_id, date, poster_account_id)
+                    WHERE poster_account_id IS NOT NULL
+                """)
 
             conn.commit()
             conn.close()
+            return True
 
         except Exception as e:
             logger.error(f"shift_closings unique fix migration error: {e}")
+            return False
 
     def _migrate_cafe_salaries(self):
         """Add salaries_created and salaries_data columns to shift_closings for cafe salary tracking"""
@@ -922,29 +1141,20 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            for col_sql in [
-                ("salaries_created", "ALTER TABLE shift_closings ADD COLUMN salaries_created INTEGER DEFAULT 0"
-                 if DB_TYPE == "sqlite" else
-                 "ALTER TABLE shift_closings ADD COLUMN salaries_created BOOLEAN DEFAULT FALSE"),
-                ("salaries_data", "ALTER TABLE shift_closings ADD COLUMN salaries_data TEXT DEFAULT NULL"),
-            ]:
-                try:
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("SAVEPOINT migration_sp")
-                    cursor.execute(col_sql[1])
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("RELEASE SAVEPOINT migration_sp")
-                    logger.info(f"✅ Cafe salaries migration: added {col_sql[0]} to shift_closings")
-                except Exception:
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("ROLLBACK TO SAVEPOINT migration_sp")
+            added = self._add_missing_columns(cursor, "shift_closings", [
+                ("salaries_created", "INTEGER DEFAULT 0" if DB_TYPE == "sqlite" else "BOOLEAN DEFAULT FALSE"),
+                ("salaries_data", "TEXT DEFAULT NULL"),
+            ])
 
             conn.commit()
             conn.close()
-            logger.info("✅ Cafe salaries migration: completed")
+            if added:
+                logger.info(f"✅ Cafe salaries migration: added {', '.join(added)} to shift_closings")
+            return True
 
         except Exception as e:
             logger.error(f"Cafe salaries migration error: {e}")
+            return False
 
     def _migrate_daily_transactions_log(self):
         """Create daily_transactions_log table to track when daily transactions were created per date"""
@@ -978,9 +1188,11 @@ class UserDatabase:
             conn.commit()
             conn.close()
             logger.info("✅ daily_transactions_log table: ready")
+            return True
 
         except Exception as e:
             logger.error(f"daily_transactions_log migration error: {e}")
+            return False
 
     def _migrate_daily_transactions_config(self):
         """Create daily_transactions_config table for user-editable daily transaction rules"""
@@ -1034,9 +1246,11 @@ class UserDatabase:
             conn.commit()
             conn.close()
             logger.info("✅ daily_transactions_config table: ready")
+            return True
 
         except Exception as e:
             logger.error(f"daily_transactions_config migration error: {e}")
+            return False
 
     def _migrate_cafe_access(self):
         """Create cafe_access_tokens table and add poster_account_id to shift_closings + kaspi_pizzburg column"""
@@ -1072,27 +1286,21 @@ class UserDatabase:
 
             # 2. Add poster_account_id to shift_closings (nullable, NULL = primary)
             # 3. Add kaspi_pizzburg column to shift_closings (for Cafe: deliveries via Pizzburg couriers)
-            for col_name, col_sql in [
-                ("poster_account_id", "ALTER TABLE shift_closings ADD COLUMN poster_account_id INTEGER DEFAULT NULL"),
-                ("kaspi_pizzburg", "ALTER TABLE shift_closings ADD COLUMN kaspi_pizzburg REAL DEFAULT 0"),
-            ]:
-                try:
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("SAVEPOINT migration_sp")
-                    cursor.execute(col_sql)
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("RELEASE SAVEPOINT migration_sp")
-                    logger.info(f"✅ Cafe migration: added {col_name} to shift_closings")
-                except Exception:
-                    if DB_TYPE != "sqlite":
-                        cursor.execute("ROLLBACK TO SAVEPOINT migration_sp")
+            added = self._add_missing_columns(cursor, "shift_closings", [
+                ("poster_account_id", "INTEGER DEFAULT NULL"),
+                ("kaspi_pizzburg", "REAL DEFAULT 0"),
+            ])
 
             conn.commit()
             conn.close()
+            if added:
+                logger.info(f"✅ Cafe migration: added {', '.join(added)} to shift_closings")
             logger.info("✅ Cafe migration: completed")
+            return True
 
         except Exception as e:
             logger.error(f"Cafe migration error: {e}")
+            return False
 
     def _migrate_cashier_access(self):
         """Create cashier_access_tokens and cashier_shift_data tables, add transfers_created to shift_closings"""
@@ -1177,26 +1385,19 @@ class UserDatabase:
                 """)
 
             # 3. Add transfers_created to shift_closings
-            try:
-                if DB_TYPE != "sqlite":
-                    cursor.execute("SAVEPOINT migration_sp")
-                if DB_TYPE == "sqlite":
-                    cursor.execute("ALTER TABLE shift_closings ADD COLUMN transfers_created INTEGER DEFAULT 0")
-                else:
-                    cursor.execute("ALTER TABLE shift_closings ADD COLUMN transfers_created BOOLEAN DEFAULT FALSE")
-                if DB_TYPE != "sqlite":
-                    cursor.execute("RELEASE SAVEPOINT migration_sp")
+            if self._add_missing_columns(cursor, "shift_closings", [
+                ("transfers_created", "INTEGER DEFAULT 0" if DB_TYPE == "sqlite" else "BOOLEAN DEFAULT FALSE"),
+            ]):
                 logger.info("✅ Cashier migration: added transfers_created to shift_closings")
-            except Exception:
-                if DB_TYPE != "sqlite":
-                    cursor.execute("ROLLBACK TO SAVEPOINT migration_sp")
 
             conn.commit()
             conn.close()
             logger.info("✅ Cashier migration: completed")
+            return True
 
         except Exception as e:
             logger.error(f"Cashier migration error: {e}")
+            return False
 
     def _migrate_web_users(self):
         """Create web_users table for session-based authentication with roles"""
@@ -1240,9 +1441,11 @@ class UserDatabase:
             conn.commit()
             conn.close()
             logger.info("✅ Web users migration: completed")
+            return True
 
         except Exception as e:
             logger.error(f"Web users migration error: {e}")
+            return False
 
     def _migrate_to_multi_account(self):
         """
@@ -1254,199 +1457,115 @@ class UserDatabase:
             cursor = conn.cursor()
 
             # Check if migration is needed (poster_accounts is empty)
-            if DB_TYPE == "sqlite":
-                cursor.execute("SELECT COUNT(*) as count FROM poster_accounts")
-                count = cursor.fetchone()[0]
-            else:
-                cursor.execute("SELECT COUNT(*) as count FROM poster_accounts")
-                count = cursor.fetchone()[0]
+            cursor.execute("SELECT 1 FROM poster_accounts LIMIT 1")
 
-            if count > 0:
+            if cursor.fetchone() is not None:
                 # Migration already done
                 conn.close()
                 logger.info("✅ Multi-account migration: already completed")
-                return
-
-            # Get all users with poster credentials
-            cursor.execute("""
-                SELECT telegram_user_id, poster_token, poster_user_id, poster_base_url, created_at, updated_at
-                FROM users
-                WHERE poster_token IS NOT NULL AND poster_token != ''
-            """)
-            users = cursor.fetchall()
-
-            migrated_count = 0
-            for user in users:
-                telegram_user_id = user[0]
-                poster_token = user[1]
-                poster_user_id = user[2]
-                poster_base_url = user[3]
-                created_at = user[4]
-                updated_at = user[5]
-
-                # Insert into poster_accounts as primary account
-                if DB_TYPE == "sqlite":
-                    cursor.execute("""
-                        INSERT INTO poster_accounts (
-                            telegram_user_id, account_name, poster_token, poster_user_id,
-                            poster_base_url, is_primary, created_at, updated_at
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        telegram_user_id, "Pizzburg", poster_token, poster_user_id,
-                        poster_base_url, 1, created_at, updated_at
-                    ))
-                else:
-                    cursor.execute("""
-                        INSERT INTO poster_accounts (
-                            telegram_user_id, account_name, poster_token, poster_user_id,
-                            poster_base_url, is_primary, created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        telegram_user_id, "Pizzburg", poster_token, poster_user_id,
-                        poster_base_url, True, created_at, updated_at
-                    ))
-
-                migrated_count += 1
-
-            conn.commit()
-            conn.close()
-
-            if migrated_count > 0:
-                logger.info(f"✅ Multi-account migration: moved {migrated_count} users to poster_accounts")
-            else:
-                logger.info("✅ Multi-account migration: no users to migrate")
-
-        except Exception as e:
-            logger.error(f"❌ Multi-account migration failed: {e}")
-            # Don't crash the app if migration fails
-
-    def _migrate_supply_items_add_account(self):
-        """Add poster_account_id column to supply_draft_items table"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN poster_account_id INTEGER")
-            else:
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS poster_account_id INTEGER")
-
-            conn.commit()
-            conn.close()
-            logger.info("✅ Supply items migration: added poster_account_id column")
-        except Exception as e:
-            # Column probably already exists
-            logger.info(f"✅ Supply items migration: poster_account_id column already exists or error: {e}")
-
-        # Also add account_id and source to supply_drafts
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                try:
-                    cursor.execute("ALTER TABLE supply_drafts ADD COLUMN account_id INTEGER")
-                except Exception:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE supply_drafts ADD COLUMN source TEXT DEFAULT 'cash'")
-                except Exception:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE supply_drafts ADD COLUMN supplier_id INTEGER")
-                except Exception:
-                    pass
-            else:
-                cursor.execute("ALTER TABLE supply_drafts ADD COLUMN IF NOT EXISTS account_id INTEGER")
-                cursor.execute("ALTER TABLE supply_drafts ADD COLUMN IF NOT EXISTS source TEXT DEFAULT 'cash'")
-                cursor.execute("ALTER TABLE supply_drafts ADD COLUMN IF NOT EXISTS supplier_id INTEGER")
-
-            conn.commit()
-            conn.close()
-            logger.info("✅ Supply drafts migration: added account_id and source columns")
-        except Exception as e:
-            logger.info(f"✅ Supply drafts migration: columns already exist or error: {e}")
+                return True
 
-        # Add item_type column to supply_draft_items (ingredient vs product)
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            # Get all users with poster credentials
+            cursor.execute("""
+                SELECT telegram_user_id, poster_token, poster_user_id, poster_base_url, created_at, updated_at
+                FROM users
+                WHERE poster_token IS NOT NULL AND poster_token != ''
+            """)
+            users = cursor.fetchall()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN item_type TEXT DEFAULT 'ingredient'")
-            else:
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS item_type TEXT DEFAULT 'ingredient'")
+            # Every existing user becomes the primary "Pizzburg" account
+            is_primary = 1 if DB_TYPE == "sqlite" else True
+            rows = [
+                (telegram_user_id, "Pizzburg", poster_token, poster_user_id,
+                 poster_base_url, is_primary, created_at, updated_at)
+                for telegram_user_id, poster_token, poster_user_id, poster_base_url,
+                    created_at, updated_at in users
+            ]
+            self._insert_many(cursor, "poster_accounts", (
+                "telegram_user_id", "account_name", "poster_token", "poster_user_id",
+                "poster_base_url", "is_primary", "created_at", "updated_at"
+            ), rows)
+            migrated_count = len(rows)
 
             conn.commit()
             conn.close()
-            logger.info("✅ Supply items migration: added item_type column")
-        except Exception as e:
-            logger.info(f"✅ Supply items migration: item_type column already exists or error: {e}")
-
-        # Add storage_id and storage_name columns to supply_draft_items
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN storage_id INTEGER DEFAULT 1")
-                except:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN storage_name TEXT")
-                except:
-                    pass
+            if migrated_count > 0:
+                logger.info(f"✅ Multi-account migration: moved {migrated_count} users to poster_accounts")
             else:
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS storage_id INTEGER DEFAULT 1")
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS storage_name TEXT")
+                logger.info("✅ Multi-account migration: no users to migrate")
+            return True
 
-            conn.commit()
-            conn.close()
-            logger.info("✅ Supply items migration: added storage_id and storage_name columns")
         except Exception as e:
-            logger.info(f"✅ Supply items migration: storage columns already exist or error: {e}")
+            logger.error(f"❌ Multi-account migration failed: {e}")
+            # Don't crash the app if migration fails
+            return False
 
-        # Add poster_account_name column to supply_draft_items
+    def _migrate_supply_items_add_account(self):
+        """Add account, source and storage columns to supply_drafts / supply_draft_items"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
             if DB_TYPE == "sqlite":
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN poster_account_name TEXT")
-                except:
-                    pass
-            else:
-                cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS poster_account_name TEXT")
+                # sqlite3 autocommits DDL; an explicit BEGIN makes it one commit
+                cursor.execute("BEGIN")
+
+            added = self._add_missing_columns(cursor, "supply_drafts", [
+                ("account_id", "INTEGER"),
+                ("source", "TEXT DEFAULT 'cash'"),
+                ("supplier_id", "INTEGER"),
+            ])
+            added += self._add_missing_columns(cursor, "supply_draft_items", [
+                ("poster_account_id", "INTEGER"),
+                # ingredient vs product
+                ("item_type", "TEXT DEFAULT 'ingredient'"),
+                ("storage_id", "INTEGER DEFAULT 1"),
+                ("storage_name", "TEXT"),
+                ("poster_account_name", "TEXT"),
+            ])
 
             conn.commit()
             conn.close()
-            logger.info("✅ Supply items migration: added poster_account_name column")
+            if added:
+                logger.info(f"✅ Supply drafts migration: added columns {', '.join(added)}")
+            return True
         except Exception as e:
-            logger.info(f"✅ Supply items migration: poster_account_name column already exists or error: {e}")
+            logger.error(f"Supply drafts migration error: {e}")
+            return False
 
     def get_user(self, telegram_user_id: int) -> Optional[Dict]:
         """Get user by Telegram ID"""
+        cached = self._user_cache.get(telegram_user_id)
+        if cached is not None:
+            return dict(cached)
+
+        generation = self._user_cache.generation
         conn = self._get_connection()
 
         if DB_TYPE == "sqlite":
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT * FROM users WHERE telegram_user_id = ?
+                SELECT telegram_user_id, poster_token, poster_user_id, poster_base_url,
+                       subscription_status, subscription_expires_at, created_at, updated_at
+                FROM users WHERE telegram_user_id = ?
             """, (telegram_user_id,))
             row = cursor.fetchone()
         else:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM users WHERE telegram_user_id = %s
+            self._execute_prepared(cursor, "get_user", """
+                SELECT telegram_user_id, poster_token, poster_user_id, poster_base_url,
+                       subscription_status, subscription_expires_at, created_at, updated_at
+                FROM users WHERE telegram_user_id = $1
             """, (telegram_user_id,))
             row = cursor.fetchone()
 
         conn.close()
 
         if row:
-            return dict(row)
+            user = dict(row)
+            self._user_cache.set(telegram_user_id, user, generation)
+            return dict(user)
         return None
 
     def create_user(
@@ -1516,6 +1635,7 @@ class UserDatabase:
 
             conn.commit()
             conn.close()
+            self._user_cache.invalidate(telegram_user_id)
 
             logger.info(f"✅ User created: telegram_id={telegram_user_id}")
             return True
@@ -1533,46 +1653,33 @@ class UserDatabase:
         subscription_status: Optional[str] = None
     ) -> bool:
         """Update user info"""
+        values = {
+            "poster_token": poster_token,
+            "poster_user_id": poster_user_id,
+            "poster_base_url": poster_base_url,
+            "subscription_status": subscription_status,
+        }
+        # Fixed column order: the same set of fields always yields the same SQL text
+        columns = [column for column in values if values[column]]
+        if not columns:
+            return False
+
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            updates = []
-            params = []
-
-            if poster_token:
-                updates.append("poster_token = ?")
-                params.append(poster_token)
-            if poster_user_id:
-                updates.append("poster_user_id = ?")
-                params.append(poster_user_id)
-            if poster_base_url:
-                updates.append("poster_base_url = ?")
-                params.append(poster_base_url)
-            if subscription_status:
-                updates.append("subscription_status = ?")
-                params.append(subscription_status)
-
-            if not updates:
-                return False
-
-            updates.append("updated_at = ?")
+            ph = "?" if DB_TYPE == "sqlite" else "%s"
+            now = datetime.now()
+            params = [values[column] for column in columns]
+            params.append(now.isoformat() if DB_TYPE == "sqlite" else now)
+            params.append(telegram_user_id)
 
-            if DB_TYPE == "sqlite":
-                params.append(datetime.now().isoformat())
-                params.append(telegram_user_id)
-                query = f"UPDATE users SET {', '.join(updates)} WHERE telegram_user_id = ?"
-                cursor.execute(query, params)
-            else:
-                # For PostgreSQL, replace ? with %s
-                updates_pg = [u.replace("?", "%s") for u in updates]
-                params.append(datetime.now())
-                params.append(telegram_user_id)
-                query = f"UPDATE users SET {', '.join(updates_pg)} WHERE telegram_user_id = %s"
-                cursor.execute(query, params)
+            assignments = ", ".join(f"{column} = {ph}" for column in columns + ["updated_at"])
+            cursor.execute(f"UPDATE users SET {assignments} WHERE telegram_user_id = {ph}", params)
 
             conn.commit()
             conn.close()
+            self._user_cache.invalidate(telegram_user_id)
 
             logger.info(f"✅ User updated: telegram_id={telegram_user_id}")
             return True
@@ -1594,6 +1701,13 @@ class UserDatabase:
 
             conn.commit()
             conn.close()
+            self._user_cache.invalidate(telegram_user_id)
+            # Templates and aliases go with the user (ON DELETE CASCADE)
+            self._template_cache.invalidate_group(telegram_user_id)
+            self._supplier_alias_cache.invalidate_group(telegram_user_id)
+            self._expense_draft_cache.clear()
+            self._no_pending_supply_cache.invalidate(telegram_user_id)
+            self._supply_draft_cache.clear()
 
             logger.info(f"✅ User deleted: telegram_id={telegram_user_id}")
             return True
@@ -1620,12 +1734,46 @@ class UserDatabase:
                 expires_at = user['subscription_expires_at']
 
             if datetime.now() > expires_at:
-                # Update status to expired
-                self.update_user(telegram_user_id, subscription_status='expired')
+                # The stored status is flipped by expire_subscriptions(), not on this read path
                 return False
 
         return True
 
+    def expire_subscriptions(self) -> int:
+        """Mark every subscription past its expiry date as expired. Returns the number of users updated"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            if DB_TYPE == "sqlite":
+                now = datetime.now().isoformat()
+                # Expiry is stored as text in both 'T' and space-separated form;
+                # compare parsed values, not strings (' ' sorts before 'T')
+                expired_check = "datetime(subscription_expires_at) < datetime(?)"
+            else:
+                now = datetime.now()
+                expired_check = "subscription_expires_at < ?"
+            cursor.execute(_q(f"""
+                UPDATE users
+                SET subscription_status = 'expired', updated_at = ?
+                WHERE subscription_status <> 'expired'
+                  AND subscription_expires_at IS NOT NULL
+                  AND {expired_check}
+            """), (now, now))
+            expired_count = cursor.rowcount
+
+            conn.commit()
+            conn.close()
+
+            if expired_count:
+                self._user_cache.clear()
+                logger.info(f"✅ Subscriptions expired: {expired_count} users")
+            return expired_count
+
+        except Exception as e:
+            logger.error(f"Failed to expire subscriptions: {e}")
+            return 0
+
     # === Poster Accounts Methods ===
 
     def get_all_user_ids_with_accounts(self) -> list:
@@ -1657,17 +1805,17 @@ class UserDatabase:
             rows = cursor.fetchall()
         else:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
+            self._execute_prepared(cursor, "get_accounts", """
                 SELECT id, account_name, poster_token, poster_user_id, poster_base_url,
                        is_primary, created_at, updated_at
                 FROM poster_accounts
-                WHERE telegram_user_id = %s
+                WHERE telegram_user_id = $1
                 ORDER BY is_primary DESC, account_name
             """, (telegram_user_id,))
             rows = cursor.fetchall()
 
         conn.close()
-        return [dict(row) for row in rows]
+        return _dict_rows(rows)
 
     def get_primary_account(self, telegram_user_id: int) -> Optional[Dict]:
         """Get primary Poster account for a user"""
@@ -1739,8 +1887,8 @@ class UserDatabase:
         poster_user_id: str,
         poster_base_url: str,
         is_primary: bool = False
-    ) -> bool:
-        """Add a new Poster account for a user"""
+    ) -> Optional[int]:
+        """Add a new Poster account for a user. Returns the account id, or None on failure"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
@@ -1752,6 +1900,7 @@ class UserDatabase:
                         telegram_user_id, account_name, poster_token, poster_user_id,
                         poster_base_url, is_primary, created_at, updated_at
                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    RETURNING id
                 """, (
                     telegram_user_id, account_name, poster_token, poster_user_id,
                     poster_base_url, 1 if is_primary else 0, now.isoformat(), now.isoformat()
@@ -1762,23 +1911,30 @@ class UserDatabase:
                         telegram_user_id, account_name, poster_token, poster_user_id,
                         poster_base_url, is_primary, created_at, updated_at
                     ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
                 """, (
                     telegram_user_id, account_name, poster_token, poster_user_id,
                     poster_base_url, is_primary, now, now
                 ))
 
+            account_id = cursor.fetchone()[0]
             conn.commit()
             conn.close()
 
             logger.info(f"✅ Poster account added: {account_name} for telegram_id={telegram_user_id}")
-            return True
+            return account_id
 
         except Exception as e:
             logger.error(f"Failed to add poster account: {e}")
-            return False
+            return None
 
     # === Ingredient Aliases Methods ===
 
+    @staticmethod
+    def _normalize_alias(alias_text: str) -> str:
+        """Canonical form aliases are stored and looked up in"""
+        return alias_text.strip().lower()
+
     def get_ingredient_aliases(self, telegram_user_id: int) -> list:
         """Get all ingredient aliases for a user"""
         conn = self._get_connection()
@@ -1794,17 +1950,17 @@ class UserDatabase:
             rows = cursor.fetchall()
         else:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
+            self._execute_prepared(cursor, "get_ingredient_aliases", """
                 SELECT id, alias_text, poster_item_id, poster_item_name, source, notes
                 FROM ingredient_aliases
-                WHERE telegram_user_id = %s
+                WHERE telegram_user_id = $1
                 ORDER BY alias_text
             """, (telegram_user_id,))
             rows = cursor.fetchall()
 
         conn.close()
 
-        return [dict(row) for row in rows]
+        return _dict_rows(rows)
 
     def add_ingredient_alias(
         self,
@@ -1814,29 +1970,35 @@ class UserDatabase:
         poster_item_name: str,
         source: str = "user",
         notes: str = ""
-    ) -> bool:
-        """Add or update an ingredient alias"""
+    ) -> Optional[int]:
+        """Add or update an ingredient alias. Returns the alias id, or None on failure"""
+        alias_normalized = self._normalize_alias(alias_text)
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
             if DB_TYPE == "sqlite":
-                # SQLite: INSERT OR REPLACE
                 cursor.execute("""
-                    INSERT OR REPLACE INTO ingredient_aliases (
+                    INSERT INTO ingredient_aliases (
                         telegram_user_id, alias_text, poster_item_id,
                         poster_item_name, source, notes, created_at
                     ) VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+                    ON CONFLICT (telegram_user_id, alias_text)
+                    DO UPDATE SET
+                        poster_item_id = excluded.poster_item_id,
+                        poster_item_name = excluded.poster_item_name,
+                        source = excluded.source,
+                        notes = excluded.notes
+                    RETURNING id
                 """, (
                     telegram_user_id,
-                    alias_text.strip().lower(),
+                    alias_normalized,
                     poster_item_id,
                     poster_item_name,
                     source,
                     notes
                 ))
             else:
-                # PostgreSQL: ON CONFLICT UPDATE
                 cursor.execute("""
                     INSERT INTO ingredient_aliases (
                         telegram_user_id, alias_text, poster_item_id,
@@ -1848,41 +2010,38 @@ class UserDatabase:
                         poster_item_name = EXCLUDED.poster_item_name,
                         source = EXCLUDED.source,
                         notes = EXCLUDED.notes
+                    RETURNING id
                 """, (
                     telegram_user_id,
-                    alias_text.strip().lower(),
+                    alias_normalized,
                     poster_item_id,
                     poster_item_name,
                     source,
                     notes
                 ))
 
+            alias_id = cursor.fetchone()[0]
             conn.commit()
             conn.close()
 
             logger.info(f"✅ Alias added: '{alias_text}' -> {poster_item_name} (ID={poster_item_id})")
-            return True
+            return alias_id
 
         except Exception as e:
             logger.error(f"Failed to add alias: {e}")
-            return False
+            return None
 
     def delete_ingredient_alias(self, telegram_user_id: int, alias_text: str) -> bool:
         """Delete an ingredient alias"""
+        alias_normalized = self._normalize_alias(alias_text)
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    DELETE FROM ingredient_aliases
-                    WHERE telegram_user_id = ? AND alias_text = ?
-                """, (telegram_user_id, alias_text.strip().lower()))
-            else:
-                cursor.execute("""
-                    DELETE FROM ingredient_aliases
-                    WHERE telegram_user_id = %s AND alias_text = %s
-                """, (telegram_user_id, alias_text.strip().lower()))
+            cursor.execute(_q("""
+                DELETE FROM ingredient_aliases
+                WHERE telegram_user_id = ? AND alias_text = ?
+            """), (telegram_user_id, alias_normalized))
 
             conn.commit()
             conn.close()
@@ -1894,52 +2053,99 @@ class UserDatabase:
             logger.error(f"Failed to delete alias: {e}")
             return False
 
-    def bulk_add_aliases(self, telegram_user_id: int, aliases: list) -> int:
+    def bulk_add_aliases(self, telegram_user_id: int, aliases: Iterable[Dict]) -> int:
         """
         Bulk add multiple aliases
 
         Args:
             telegram_user_id: User ID
-            aliases: List of dicts with keys: alias_text, poster_item_id, poster_item_name, source, notes
+            aliases: Iterable of dicts with keys: alias_text, poster_item_id, poster_item_name, source, notes.
+                Consumed in batches, so a generator never has to be materialized
 
         Returns:
             Number of aliases added
         """
+        if DB_TYPE == "sqlite":
+            sql = """
+                INSERT INTO ingredient_aliases (
+                    telegram_user_id, alias_text, poster_item_id,
+                    poster_item_name, source, notes, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT (telegram_user_id, alias_text)
+                DO UPDATE SET
+                    poster_item_id = excluded.poster_item_id,
+                    poster_item_name = excluded.poster_item_name,
+                    source = excluded.source,
+                    notes = excluded.notes
+            """
+        else:
+            sql = """
+                INSERT INTO ingredient_aliases (
+                    telegram_user_id, alias_text, poster_item_id,
+                    poster_item_name, source, notes
+                ) VALUES %s
+                ON CONFLICT (telegram_user_id, alias_text)
+                DO UPDATE SET
+                    poster_item_id = EXCLUDED.poster_item_id,
+                    poster_item_name = EXCLUDED.poster_item_name,
+                    source = EXCLUDED.source,
+                    notes = EXCLUDED.notes
+            """
+
         count = 0
-        for alias in aliases:
-            if self.add_ingredient_alias(
-                telegram_user_id=telegram_user_id,
-                alias_text=alias['alias_text'],
-                poster_item_id=alias['poster_item_id'],
-                poster_item_name=alias['poster_item_name'],
-                source=alias.get('source', 'user'),
-                notes=alias.get('notes', '')
-            ):
-                count += 1
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            iterator = iter(aliases)
+            while True:
+                batch = list(itertools.islice(iterator, 1000))
+                if not batch:
+                    break
+
+                # Keyed by normalized alias: a later duplicate wins, as with one-by-one upserts
+                # (PostgreSQL rejects a statement that hits the same conflict key twice)
+                rows = {}
+                for alias in batch:
+                    alias_text = self._normalize_alias(alias['alias_text'])
+                    rows[alias_text] = (
+                        telegram_user_id,
+                        alias_text,
+                        alias['poster_item_id'],
+                        alias['poster_item_name'],
+                        alias.get('source', 'user'),
+                        alias.get('notes', '')
+                    )
+
+                if DB_TYPE == "sqlite":
+                    cursor.executemany(sql, list(rows.values()))
+                else:
+                    execute_values(cursor, sql, list(rows.values()), page_size=len(rows))
+                count += len(batch)
+
+            # One transaction for the whole import
+            conn.commit()
+            conn.close()
 
-        logger.info(f"✅ Bulk import: {count}/{len(aliases)} aliases added")
+        except Exception as e:
+            logger.error(f"Failed to bulk add aliases: {e}")
+            return 0
+
+        if count:
+            logger.info(f"✅ Bulk import: {count} aliases added")
         return count
 
     def get_alias_by_id(self, alias_id: int, telegram_user_id: int) -> Optional[Dict]:
         """Get a single alias by ID"""
         conn = self._get_connection()
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, alias_text, poster_item_id, poster_item_name, source, notes
-                FROM ingredient_aliases
-                WHERE id = ? AND telegram_user_id = ?
-            """, (alias_id, telegram_user_id))
-            row = cursor.fetchone()
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT id, alias_text, poster_item_id, poster_item_name, source, notes
-                FROM ingredient_aliases
-                WHERE id = %s AND telegram_user_id = %s
-            """, (alias_id, telegram_user_id))
-            row = cursor.fetchone()
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q("""
+            SELECT id, alias_text, poster_item_id, poster_item_name, source, notes
+            FROM ingredient_aliases
+            WHERE id = ? AND telegram_user_id = ?
+        """), (alias_id, telegram_user_id))
+        row = cursor.fetchone()
 
         conn.close()
 
@@ -1958,46 +2164,28 @@ class UserDatabase:
         notes: str = ""
     ) -> bool:
         """Update an existing alias"""
+        alias_normalized = self._normalize_alias(alias_text)
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    UPDATE ingredient_aliases
-                    SET alias_text = ?,
-                        poster_item_id = ?,
-                        poster_item_name = ?,
-                        source = ?,
-                        notes = ?
-                    WHERE id = ? AND telegram_user_id = ?
-                """, (
-                    alias_text.strip().lower(),
-                    poster_item_id,
-                    poster_item_name,
-                    source,
-                    notes,
-                    alias_id,
-                    telegram_user_id
-                ))
-            else:
-                cursor.execute("""
-                    UPDATE ingredient_aliases
-                    SET alias_text = %s,
-                        poster_item_id = %s,
-                        poster_item_name = %s,
-                        source = %s,
-                        notes = %s
-                    WHERE id = %s AND telegram_user_id = %s
-                """, (
-                    alias_text.strip().lower(),
-                    poster_item_id,
-                    poster_item_name,
-                    source,
-                    notes,
-                    alias_id,
-                    telegram_user_id
-                ))
+            cursor.execute(_q("""
+                UPDATE ingredient_aliases
+                SET alias_text = ?,
+                    poster_item_id = ?,
+                    poster_item_name = ?,
+                    source = ?,
+                    notes = ?
+                WHERE id = ? AND telegram_user_id = ?
+            """), (
+                alias_normalized,
+                poster_item_id,
+                poster_item_name,
+                source,
+                notes,
+                alias_id,
+                telegram_user_id
+            ))
 
             conn.commit()
             conn.close()
@@ -2015,16 +2203,10 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    DELETE FROM ingredient_aliases
-                    WHERE id = ? AND telegram_user_id = ?
-                """, (alias_id, telegram_user_id))
-            else:
-                cursor.execute("""
-                    DELETE FROM ingredient_aliases
-                    WHERE id = %s AND telegram_user_id = %s
-                """, (alias_id, telegram_user_id))
+            cursor.execute(_q("""
+                DELETE FROM ingredient_aliases
+                WHERE id = ? AND telegram_user_id = ?
+            """), (alias_id, telegram_user_id))
 
             conn.commit()
             conn.close()
@@ -2051,60 +2233,34 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            # Fetch all aliases for this user
+            # One anti-join DELETE on the server; the id list goes in as a single parameter
+            valid_ids = [int(i) for i in valid_ingredient_ids]
             if DB_TYPE == "sqlite":
                 cursor.execute("""
-                    SELECT id, alias_text, poster_item_id
-                    FROM ingredient_aliases
+                    DELETE FROM ingredient_aliases
                     WHERE telegram_user_id = ?
-                """, (telegram_user_id,))
+                      AND poster_item_id NOT IN (SELECT value FROM json_each(?))
+                    RETURNING alias_text, poster_item_id
+                """, (telegram_user_id, json.dumps(valid_ids)))
             else:
                 cursor.execute("""
-                    SELECT id, alias_text, poster_item_id
-                    FROM ingredient_aliases
+                    DELETE FROM ingredient_aliases
                     WHERE telegram_user_id = %s
-                """, (telegram_user_id,))
-
-            all_aliases = cursor.fetchall()
+                      AND poster_item_id <> ALL(%s::int[])
+                    RETURNING alias_text, poster_item_id
+                """, (telegram_user_id, valid_ids))
 
-            # Find orphaned aliases
-            orphaned_ids = []
-            for alias in all_aliases:
-                if DB_TYPE == "sqlite":
-                    alias_id = alias['id']
-                    poster_item_id = alias['poster_item_id']
-                    alias_text = alias['alias_text']
-                else:
-                    alias_id = alias[0]
-                    poster_item_id = alias[2]
-                    alias_text = alias[1]
-
-                if poster_item_id not in valid_ingredient_ids:
-                    orphaned_ids.append(alias_id)
-                    logger.info(f"  Orphaned alias: '{alias_text}' -> ingredient_id {poster_item_id} (deleted)")
-
-            # Delete orphaned aliases
-            if orphaned_ids:
-                if DB_TYPE == "sqlite":
-                    placeholders = ','.join('?' * len(orphaned_ids))
-                    cursor.execute(f"""
-                        DELETE FROM ingredient_aliases
-                        WHERE id IN ({placeholders}) AND telegram_user_id = ?
-                    """, orphaned_ids + [telegram_user_id])
-                else:
-                    placeholders = ','.join(['%s'] * len(orphaned_ids))
-                    cursor.execute(f"""
-                        DELETE FROM ingredient_aliases
-                        WHERE id IN ({placeholders}) AND telegram_user_id = %s
-                    """, orphaned_ids + [telegram_user_id])
+            orphaned = cursor.fetchall()
+            for alias_text, poster_item_id in orphaned:
+                logger.info(f"  Orphaned alias: '{alias_text}' -> ingredient_id {poster_item_id} (deleted)")
 
             conn.commit()
             conn.close()
 
-            if orphaned_ids:
-                logger.info(f"✅ Cleaned {len(orphaned_ids)} orphaned ingredient aliases for user {telegram_user_id}")
+            if orphaned:
+                logger.info(f"✅ Cleaned {len(orphaned)} orphaned ingredient aliases for user {telegram_user_id}")
 
-            return len(orphaned_ids)
+            return len(orphaned)
 
         except Exception as e:
             logger.error(f"Failed to clean orphaned aliases: {e}")
@@ -2114,23 +2270,18 @@ class UserDatabase:
 
     def _migrate_packaging_and_habits(self):
         """Add columns to supply_draft_items and create packaging_rules and ingredient_habits tables"""
+        ok = True
+
         # 1. Add columns to supply_draft_items
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             if DB_TYPE == "sqlite":
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN parsed_quantity REAL")
-                except:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN parsed_unit TEXT")
-                except:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN parsed_price_per_unit REAL")
-                except:
-                    pass
+                self._add_missing_columns(cursor, "supply_draft_items", [
+                    ("parsed_quantity", "REAL"),
+                    ("parsed_unit", "TEXT"),
+                    ("parsed_price_per_unit", "REAL"),
+                ])
             else:
                 cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS parsed_quantity DECIMAL(10,3)")
                 cursor.execute("ALTER TABLE supply_draft_items ADD COLUMN IF NOT EXISTS parsed_unit TEXT")
@@ -2140,6 +2291,7 @@ class UserDatabase:
             logger.info("✅ supply_draft_items migration: added parsed_quantity, parsed_unit, parsed_price_per_unit")
         except Exception as e:
             logger.error(f"❌ Failed to migrate supply_draft_items: {e}")
+            ok = False
 
         # 2. Create ingredient_packaging_rules table
         try:
@@ -2182,6 +2334,7 @@ class UserDatabase:
             logger.info("✅ Created ingredient_packaging_rules table")
         except Exception as e:
             logger.error(f"❌ Failed to create ingredient_packaging_rules table: {e}")
+            ok = False
 
         # 3. Create ingredient_habits table
         try:
@@ -2222,9 +2375,14 @@ class UserDatabase:
             logger.info("✅ Created ingredient_habits table")
         except Exception as e:
             logger.error(f"❌ Failed to create ingredient_habits table: {e}")
+            ok = False
+
+        return ok
 
     def _migrate_packaging_and_habits_account(self):
         """Add account_name column and update UNIQUE constraints on ingredient_packaging_rules and ingredient_habits tables"""
+        ok = True
+
         # 1. Update ingredient_packaging_rules
         try:
             conn = self._get_connection()
@@ -2296,6 +2454,7 @@ class UserDatabase:
             conn.close()
         except Exception as e:
             logger.error(f"❌ Failed to migrate ingredient_packaging_rules: {e}")
+            ok = False
 
         # 2. Update ingredient_habits
         try:
@@ -2367,6 +2526,9 @@ class UserDatabase:
             conn.close()
         except Exception as e:
             logger.error(f"❌ Failed to migrate ingredient_habits: {e}")
+            ok = False
+
+        return ok
 
     def get_packaging_rules(self, telegram_user_id: int) -> list:
         """Get all ingredient packaging rules for a user"""
@@ -2379,9 +2541,7 @@ class UserDatabase:
                     FROM ingredient_packaging_rules
                     WHERE telegram_user_id = ?
                 """, (telegram_user_id,))
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                res = [dict(zip(columns, row)) for row in rows]
+                res = [dict(row) for row in cursor.fetchall()]
             else:
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute("""
@@ -2389,7 +2549,7 @@ class UserDatabase:
                     FROM ingredient_packaging_rules
                     WHERE telegram_user_id = %s
                 """, (telegram_user_id,))
-                res = [dict(row) for row in cursor.fetchall()]
+                res = cursor.fetchall()
             conn.close()
             return res
         except Exception as e:
@@ -2491,9 +2651,7 @@ class UserDatabase:
                     FROM ingredient_habits
                     WHERE telegram_user_id = ?
                 """, (telegram_user_id,))
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                res = [dict(zip(columns, row)) for row in rows]
+                res = [dict(row) for row in cursor.fetchall()]
             else:
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute("""
@@ -2501,7 +2659,7 @@ class UserDatabase:
                     FROM ingredient_habits
                     WHERE telegram_user_id = %s
                 """, (telegram_user_id,))
-                res = [dict(row) for row in cursor.fetchall()]
+                res = cursor.fetchall()
             conn.close()
             return res
         except Exception as e:
@@ -2568,35 +2726,23 @@ class UserDatabase:
 
     def get_supply_draft_item(self, item_id: int, telegram_user_id: int = None) -> Optional[Dict]:
         """Получить позицию из черновика поставки по ее ID"""
+        query = "SELECT i.* FROM supply_draft_items i"
+        params = [item_id]
+        if telegram_user_id is not None:
+            query += " JOIN supply_drafts d ON i.supply_draft_id = d.id WHERE i.id = ? AND d.telegram_user_id = ?"
+            params.append(telegram_user_id)
+        else:
+            query += " WHERE i.id = ?"
+
         try:
             conn = self._get_connection()
-            if DB_TYPE == "sqlite":
-                cursor = conn.cursor()
-                if telegram_user_id is not None:
-                    cursor.execute("""
-                        SELECT i.* FROM supply_draft_items i
-                        JOIN supply_drafts d ON i.supply_draft_id = d.id
-                        WHERE i.id = ? AND d.telegram_user_id = ?
-                    """, (item_id, telegram_user_id))
-                else:
-                    cursor.execute("SELECT * FROM supply_draft_items WHERE id = ?", (item_id,))
-                row = cursor.fetchone()
-                columns = [desc[0] for desc in cursor.description] if row else []
-                res = dict(zip(columns, row)) if row else None
-            else:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                if telegram_user_id is not None:
-                    cursor.execute("""
-                        SELECT i.* FROM supply_draft_items i
-                        JOIN supply_drafts d ON i.supply_draft_id = d.id
-                        WHERE i.id = %s AND d.telegram_user_id = %s
-                    """, (item_id, telegram_user_id))
-                else:
-                    cursor.execute("SELECT * FROM supply_draft_items WHERE id = %s", (item_id,))
+            try:
+                cursor = self._dict_cursor(conn)
+                cursor.execute(_q(query), params)
                 row = cursor.fetchone()
-                res = dict(row) if row else None
-            conn.close()
-            return res
+            finally:
+                conn.close()
+            return dict(row) if row else None
         except Exception as e:
             logger.error(f"Failed to get supply draft item: {e}")
             return None
@@ -2608,29 +2754,17 @@ class UserDatabase:
         """Get all supplier aliases for a user"""
         conn = self._get_connection()
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, alias_text, poster_supplier_id, poster_supplier_name, notes, created_at
-                FROM supplier_aliases
-                WHERE telegram_user_id = ?
-                ORDER BY alias_text
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(columns, row)) for row in rows]
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT id, alias_text, poster_supplier_id, poster_supplier_name, notes, created_at
-                FROM supplier_aliases
-                WHERE telegram_user_id = %s
-                ORDER BY alias_text
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q("""
+            SELECT id, alias_text, poster_supplier_id, poster_supplier_name, notes, created_at
+            FROM supplier_aliases
+            WHERE telegram_user_id = ?
+            ORDER BY alias_text
+        """), (telegram_user_id,))
+        rows = cursor.fetchall()
 
         conn.close()
-        return [dict(row) for row in rows]
+        return _dict_rows(rows)
 
     def add_supplier_alias(
         self,
@@ -2641,45 +2775,35 @@ class UserDatabase:
         notes: str = ""
     ) -> bool:
         """Add or update a supplier alias"""
+        alias_normalized = self._normalize_alias(alias_text)
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    INSERT OR REPLACE INTO supplier_aliases (
-                        telegram_user_id, alias_text, poster_supplier_id,
-                        poster_supplier_name, notes, created_at
-                    ) VALUES (?, ?, ?, ?, ?, datetime('now'))
-                """, (
-                    telegram_user_id,
-                    alias_text.strip().lower(),
-                    poster_supplier_id,
-                    poster_supplier_name,
-                    notes
-                ))
-            else:
-                cursor.execute("""
-                    INSERT INTO supplier_aliases (
-                        telegram_user_id, alias_text, poster_supplier_id,
-                        poster_supplier_name, notes
-                    ) VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (telegram_user_id, alias_text)
-                    DO UPDATE SET
-                        poster_supplier_id = EXCLUDED.poster_supplier_id,
-                        poster_supplier_name = EXCLUDED.poster_supplier_name,
-                        notes = EXCLUDED.notes
-                """, (
-                    telegram_user_id,
-                    alias_text.strip().lower(),
-                    poster_supplier_id,
-                    poster_supplier_name,
-                    notes
-                ))
+            cursor.execute(_q("""
+                INSERT INTO supplier_aliases (
+                    telegram_user_id, alias_text, poster_supplier_id,
+                    poster_supplier_name, notes
+                ) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (telegram_user_id, alias_text)
+                DO UPDATE SET
+                    poster_supplier_id = EXCLUDED.poster_supplier_id,
+                    poster_supplier_name = EXCLUDED.poster_supplier_name,
+                    notes = EXCLUDED.notes
+            """), (
+                telegram_user_id,
+                alias_normalized,
+                poster_supplier_id,
+                poster_supplier_name,
+                notes
+            ))
 
             conn.commit()
             conn.close()
 
+            # Partial matching: a new alias can change any of the user's cached results
+            self._supplier_alias_cache.invalidate_group(telegram_user_id)
+
             logger.info(f"✅ Supplier alias added: '{alias_text}' -> {poster_supplier_name}")
             return True
 
@@ -2689,66 +2813,48 @@ class UserDatabase:
 
     def get_supplier_by_alias(self, telegram_user_id: int, alias_text: str) -> Optional[Dict]:
         """Find supplier by alias text (for Kaspi parsing)"""
-        conn = self._get_connection()
+        alias_normalized = self._normalize_alias(alias_text)
+        cache_key = (telegram_user_id, alias_normalized)
+        cached = self._supplier_alias_cache.get(cache_key, _MISSING)
+        if cached is not _MISSING:
+            # None is cached too: unknown names repeat across statement imports
+            return dict(cached) if cached else None
 
-        # Normalize alias
-        alias_normalized = alias_text.strip().lower()
+        generation = self._supplier_alias_cache.generation
 
+        # One query: an exact match wins, otherwise the first alias that contains
+        # the text or is contained in it. instr/strpos compare literally, unlike LIKE
+        conn = self._get_connection()
+        cursor = conn.cursor()
         if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            # Exact match first
             cursor.execute("""
                 SELECT poster_supplier_id, poster_supplier_name
                 FROM supplier_aliases
-                WHERE telegram_user_id = ? AND alias_text = ?
+                WHERE telegram_user_id = ?
+                  AND (instr(?2, alias_text) > 0 OR instr(alias_text, ?2) > 0)
+                ORDER BY alias_text = ?2 DESC, id
+                LIMIT 1
             """, (telegram_user_id, alias_normalized))
-            row = cursor.fetchone()
-
-            if not row:
-                # Partial match (alias contains in text or text contains alias)
-                cursor.execute("""
-                    SELECT poster_supplier_id, poster_supplier_name, alias_text
-                    FROM supplier_aliases
-                    WHERE telegram_user_id = ?
-                """, (telegram_user_id,))
-                all_aliases = cursor.fetchall()
-
-                for alias_row in all_aliases:
-                    stored_alias = alias_row[2]
-                    if stored_alias in alias_normalized or alias_normalized in stored_alias:
-                        row = alias_row[:2]
-                        break
         else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
+            # Prepared: a statement import resolves many distinct names in a row
+            self._execute_prepared(cursor, "get_supplier_by_alias", """
                 SELECT poster_supplier_id, poster_supplier_name
                 FROM supplier_aliases
-                WHERE telegram_user_id = %s AND alias_text = %s
+                WHERE telegram_user_id = $1
+                  AND (strpos($2, alias_text) > 0 OR strpos(alias_text, $2) > 0)
+                ORDER BY alias_text = $2 DESC, id
+                LIMIT 1
             """, (telegram_user_id, alias_normalized))
-            row = cursor.fetchone()
-
-            if not row:
-                cursor.execute("""
-                    SELECT poster_supplier_id, poster_supplier_name, alias_text
-                    FROM supplier_aliases
-                    WHERE telegram_user_id = %s
-                """, (telegram_user_id,))
-                all_aliases = cursor.fetchall()
-
-                for alias_row in all_aliases:
-                    stored_alias = alias_row['alias_text']
-                    if stored_alias in alias_normalized or alias_normalized in stored_alias:
-                        row = alias_row
-                        break
+        row = cursor.fetchone()
 
         conn.close()
 
-        if row:
-            if DB_TYPE == "sqlite":
-                return {'poster_supplier_id': row[0], 'poster_supplier_name': row[1]}
-            else:
-                return dict(row)
-        return None
+        if not row:
+            self._supplier_alias_cache.set(cache_key, None, generation)
+            return None
+        supplier = {'poster_supplier_id': row[0], 'poster_supplier_name': row[1]}
+        self._supplier_alias_cache.set(cache_key, supplier, generation)
+        return dict(supplier)
 
     def delete_supplier_alias(self, telegram_user_id: int, alias_id: int) -> bool:
         """Delete a supplier alias by ID"""
@@ -2756,20 +2862,16 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    DELETE FROM supplier_aliases
-                    WHERE id = ? AND telegram_user_id = ?
-                """, (alias_id, telegram_user_id))
-            else:
-                cursor.execute("""
-                    DELETE FROM supplier_aliases
-                    WHERE id = %s AND telegram_user_id = %s
-                """, (alias_id, telegram_user_id))
+            cursor.execute(_q("""
+                DELETE FROM supplier_aliases
+                WHERE id = ? AND telegram_user_id = ?
+            """), (alias_id, telegram_user_id))
 
             conn.commit()
             conn.close()
 
+            self._supplier_alias_cache.invalidate_group(telegram_user_id)
+
             logger.info(f"✅ Supplier alias deleted: ID={alias_id}")
             return True
 
@@ -2777,8 +2879,6 @@ class UserDatabase:
             logger.error(f"Failed to delete supplier alias: {e}")
             return False
 
-    # === Price History Methods ===
-
     def add_price_history(
         self,
         telegram_user_id: int,
@@ -2855,7 +2955,8 @@ class UserDatabase:
         ingredient_id: int = None,
         supplier_id: int = None,
         date_from: str = None,
-        date_to: str = None
+        date_to: str = None,
+        limit: int = None
     ) -> list:
         """
         Get price history with optional filters
@@ -2866,51 +2967,76 @@ class UserDatabase:
             supplier_id: Optional supplier ID filter
             date_from: Optional start date "YYYY-MM-DD"
             date_to: Optional end date "YYYY-MM-DD"
+            limit: Optional maximum number of (most recent) records
 
         Returns:
             List of price history records
         """
-        conn = self._get_connection()
+        return list(self.iter_price_history(
+            telegram_user_id, ingredient_id, supplier_id, date_from, date_to, limit
+        ))
+
+    def iter_price_history(
+        self,
+        telegram_user_id: int,
+        ingredient_id: int = None,
+        supplier_id: int = None,
+        date_from: str = None,
+        date_to: str = None,
+        limit: int = None
+    ):
+        """
+        Yield price history records (newest first) without loading the whole result.
 
+        Same filters as get_price_history. On PostgreSQL rows come from a
+        server-side cursor in batches; on SQLite the cursor is iterated directly.
+        Close the generator (or exhaust it) to release the connection.
+        """
         query = """
             SELECT id, ingredient_id, ingredient_name, supplier_id, supplier_name,
                    date, price, quantity, unit, supply_id, created_at
             FROM ingredient_price_history
-            WHERE telegram_user_id = {}
-        """.format('?' if DB_TYPE == 'sqlite' else '%s')
-
+            WHERE telegram_user_id = ?
+        """
         params = [telegram_user_id]
 
         if ingredient_id:
-            query += f" AND ingredient_id = {'?' if DB_TYPE == 'sqlite' else '%s'}"
+            query += " AND ingredient_id = ?"
             params.append(ingredient_id)
 
         if supplier_id:
-            query += f" AND supplier_id = {'?' if DB_TYPE == 'sqlite' else '%s'}"
+            query += " AND supplier_id = ?"
             params.append(supplier_id)
 
         if date_from:
-            query += f" AND date >= {'?' if DB_TYPE == 'sqlite' else '%s'}"
+            query += " AND date >= ?"
             params.append(date_from)
 
         if date_to:
-            query += f" AND date <= {'?' if DB_TYPE == 'sqlite' else '%s'}"
+            query += " AND date <= ?"
             params.append(date_to)
 
         query += " ORDER BY date DESC"
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
 
-        conn.close()
+        conn = self._get_connection()
+        try:
+            if DB_TYPE == "sqlite":
+                cursor = conn.cursor()
+            else:
+                cursor = conn.cursor(name="iter_price_history", cursor_factory=RealDictCursor)
+                cursor.itersize = 1000
+            cursor.execute(_q(query), params)
 
-        return [dict(row) for row in rows]
+            for row in cursor:
+                yield dict(row)
+
+            cursor.close()
+        finally:
+            conn.close()
 
     def bulk_add_price_history(self, telegram_user_id: int, records: list) -> int:
         """
@@ -2922,97 +3048,93 @@ class UserDatabase:
                     supplier_id, supplier_name, date, price, quantity, unit, supply_id
 
         Returns:
-            Number of records added
+            Number of records added (0 if the batch failed)
         """
-        count = 0
-        for record in records:
-            if self.add_price_history(
-                telegram_user_id=telegram_user_id,
-                ingredient_id=record['ingredient_id'],
-                ingredient_name=record['ingredient_name'],
-                supplier_id=record['supplier_id'],
-                supplier_name=record['supplier_name'],
-                date=record['date'],
-                price=record['price'],
-                quantity=record['quantity'],
-                unit=record['unit'],
-                supply_id=record.get('supply_id')
-            ):
-                count += 1
+        rows = [
+            (
+                telegram_user_id, record['ingredient_id'], record['ingredient_name'],
+                record['supplier_id'], record['supplier_name'], record['date'], record['price'],
+                record['quantity'], record['unit'], record.get('supply_id')
+            )
+            for record in records
+        ]
 
-        logger.info(f"✅ Bulk import: {count}/{len(records)} price history records added")
-        return count
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            self._insert_many(cursor, "ingredient_price_history", (
+                "telegram_user_id", "ingredient_id", "ingredient_name",
+                "supplier_id", "supplier_name", "date", "price",
+                "quantity", "unit", "supply_id"
+            ), rows)
+
+            conn.commit()
+            conn.close()
+
+        except Exception as e:
+            logger.error(f"Failed to bulk add price history: {e}")
+            return 0
+
+        logger.info(f"✅ Bulk import: {len(rows)} price history records added")
+        return len(rows)
 
     # === Shipment Templates Methods ===
 
     def get_shipment_templates(self, telegram_user_id: int) -> list:
         """Get all shipment templates for a user"""
         conn = self._get_connection()
-
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, template_name, supplier_id, supplier_name,
-                       account_id, account_name, storage_id, items
-                FROM shipment_templates
-                WHERE telegram_user_id = ?
-                ORDER BY template_name
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT id, template_name, supplier_id, supplier_name,
-                       account_id, account_name, storage_id, items
-                FROM shipment_templates
-                WHERE telegram_user_id = %s
-                ORDER BY template_name
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
-
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q("""
+            SELECT id, template_name, supplier_id, supplier_name,
+                   account_id, account_name, storage_id, items
+            FROM shipment_templates
+            WHERE telegram_user_id = ?
+            ORDER BY template_name
+        """), (telegram_user_id,))
+        rows = cursor.fetchall()
         conn.close()
 
-        import json
         templates = []
         for row in rows:
             template = dict(row)
-            # Parse items JSON
-            template['items'] = json.loads(template['items'])
+            template['items'] = self._load_template_items(template['items'])
             templates.append(template)
 
         return templates
 
+    @staticmethod
+    def _load_template_items(items):
+        """Decode shipment_templates.items (psycopg2 already decodes JSONB)"""
+        if isinstance(items, str):
+            return json.loads(items)
+        return items
+
     def get_shipment_template(self, telegram_user_id: int, template_name: str) -> Optional[Dict]:
         """Get a single shipment template by name"""
-        conn = self._get_connection()
-
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, template_name, supplier_id, supplier_name,
-                       account_id, account_name, storage_id, items
-                FROM shipment_templates
-                WHERE telegram_user_id = ? AND template_name = ?
-            """, (telegram_user_id, template_name.strip().lower()))
-            row = cursor.fetchone()
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT id, template_name, supplier_id, supplier_name,
-                       account_id, account_name, storage_id, items
-                FROM shipment_templates
-                WHERE telegram_user_id = %s AND template_name = %s
-            """, (telegram_user_id, template_name.strip().lower()))
-            row = cursor.fetchone()
+        name_normalized = template_name.strip().lower()
+        cache_key = (telegram_user_id, name_normalized)
+        cached = self._template_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
 
+        generation = self._template_cache.generation
+        conn = self._get_connection()
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q("""
+            SELECT id, template_name, supplier_id, supplier_name,
+                   account_id, account_name, storage_id, items
+            FROM shipment_templates
+            WHERE telegram_user_id = ? AND template_name = ?
+        """), cache_key)
+        row = cursor.fetchone()
         conn.close()
 
         if row:
-            import json
             template = dict(row)
-            # Parse items JSON
-            template['items'] = json.loads(template['items'])
-            return template
+            template['items'] = self._load_template_items(template['items'])
+            self._template_cache.set(cache_key, template, generation)
+            return copy.deepcopy(template)
         return None
 
     def create_shipment_template(
@@ -3027,49 +3149,32 @@ class UserDatabase:
         storage_id: int = 1
     ) -> bool:
         """Create a new shipment template"""
+        name_normalized = template_name.strip().lower()
         try:
-            import json
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            items_json = json.dumps(items, ensure_ascii=False)
-
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    INSERT INTO shipment_templates (
-                        telegram_user_id, template_name, supplier_id, supplier_name,
-                        account_id, account_name, storage_id, items
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    telegram_user_id,
-                    template_name.strip().lower(),
-                    supplier_id,
-                    supplier_name,
-                    account_id,
-                    account_name,
-                    storage_id,
-                    items_json
-                ))
-            else:
-                cursor.execute("""
-                    INSERT INTO shipment_templates (
-                        telegram_user_id, template_name, supplier_id, supplier_name,
-                        account_id, account_name, storage_id, items
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    telegram_user_id,
-                    template_name.strip().lower(),
-                    supplier_id,
-                    supplier_name,
-                    account_id,
-                    account_name,
-                    storage_id,
-                    items_json
-                ))
+            cursor.execute(_q("""
+                INSERT INTO shipment_templates (
+                    telegram_user_id, template_name, supplier_id, supplier_name,
+                    account_id, account_name, storage_id, items
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """), (
+                telegram_user_id,
+                name_normalized,
+                supplier_id,
+                supplier_name,
+                account_id,
+                account_name,
+                storage_id,
+                json.dumps(items, ensure_ascii=False)
+            ))
 
             conn.commit()
             conn.close()
 
+            self._template_cache.invalidate((telegram_user_id, name_normalized))
+
             logger.info(f"✅ Shipment template created: '{template_name}' for user {telegram_user_id}")
             return True
 
@@ -3089,52 +3194,38 @@ class UserDatabase:
         storage_id: int = None
     ) -> bool:
         """Update an existing shipment template"""
+        name_normalized = template_name.strip().lower()
+        fields = {
+            'supplier_id': supplier_id,
+            'supplier_name': supplier_name,
+            'account_id': account_id,
+            'account_name': account_name,
+            'storage_id': storage_id,
+        }
+        if items is not None:
+            fields['items'] = json.dumps(items, ensure_ascii=False)
+
+        updates = [f"{column} = ?" for column, value in fields.items() if value is not None]
+        if not updates:
+            return False
+        params = [value for value in fields.values() if value is not None]
+
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            updates = []
-            params = []
-
-            if supplier_id is not None:
-                updates.append("supplier_id = ?")
-                params.append(supplier_id)
-            if supplier_name is not None:
-                updates.append("supplier_name = ?")
-                params.append(supplier_name)
-            if account_id is not None:
-                updates.append("account_id = ?")
-                params.append(account_id)
-            if account_name is not None:
-                updates.append("account_name = ?")
-                params.append(account_name)
-            if storage_id is not None:
-                updates.append("storage_id = ?")
-                params.append(storage_id)
-            if items is not None:
-                import json
-                updates.append("items = ?")
-                params.append(json.dumps(items, ensure_ascii=False))
-
-            if not updates:
-                return False
-
-            if DB_TYPE == "sqlite":
-                updates.append("updated_at = datetime('now')")
-                params.extend([telegram_user_id, template_name.strip().lower()])
-                query = f"UPDATE shipment_templates SET {', '.join(updates)} WHERE telegram_user_id = ? AND template_name = ?"
-                cursor.execute(query, params)
-            else:
-                # For PostgreSQL, replace ? with %s
-                updates_pg = [u.replace("?", "%s") for u in updates]
-                updates_pg.append("updated_at = CURRENT_TIMESTAMP")
-                params.extend([telegram_user_id, template_name.strip().lower()])
-                query = f"UPDATE shipment_templates SET {', '.join(updates_pg)} WHERE telegram_user_id = %s AND template_name = %s"
-                cursor.execute(query, params)
+            # CURRENT_TIMESTAMP matches datetime('now') on SQLite
+            cursor.execute(_q(f"""
+                UPDATE shipment_templates
+                SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_user_id = ? AND template_name = ?
+            """), (*params, telegram_user_id, name_normalized))
 
             conn.commit()
             conn.close()
 
+            self._template_cache.invalidate((telegram_user_id, name_normalized))
+
             logger.info(f"✅ Shipment template updated: '{template_name}'")
             return True
 
@@ -3144,24 +3235,21 @@ class UserDatabase:
 
     def delete_shipment_template(self, telegram_user_id: int, template_name: str) -> bool:
         """Delete a shipment template"""
+        name_normalized = template_name.strip().lower()
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    DELETE FROM shipment_templates
-                    WHERE telegram_user_id = ? AND template_name = ?
-                """, (telegram_user_id, template_name.strip().lower()))
-            else:
-                cursor.execute("""
-                    DELETE FROM shipment_templates
-                    WHERE telegram_user_id = %s AND template_name = %s
-                """, (telegram_user_id, template_name.strip().lower()))
+            cursor.execute(_q("""
+                DELETE FROM shipment_templates
+                WHERE telegram_user_id = ? AND template_name = ?
+            """), (telegram_user_id, name_normalized))
 
             conn.commit()
             conn.close()
 
+            self._template_cache.invalidate((telegram_user_id, name_normalized))
+
             logger.info(f"✅ Shipment template deleted: '{template_name}'")
             return True
 
@@ -3187,6 +3275,25 @@ class UserDatabase:
             role: Employee role ('cashier', 'doner_maker', 'assistant')
             date: Date mentioned in format "YYYY-MM-DD". If None, uses current date
 
+        Returns:
+            True if successful
+        """
+        return self.add_employees(telegram_user_id, [(employee_name, role)], date)
+
+    def add_employees(
+        self,
+        telegram_user_id: int,
+        employees: Iterable,
+        date: str = None
+    ) -> bool:
+        """
+        Add or update several employees in one transaction
+
+        Args:
+            telegram_user_id: User ID
+            employees: (employee_name, role) pairs
+            date: Date mentioned in format "YYYY-MM-DD". If None, uses current date
+
         Returns:
             True if successful
         """
@@ -3194,32 +3301,31 @@ class UserDatabase:
             if date is None:
                 date = datetime.now().strftime("%Y-%m-%d")
 
+            rows = [
+                (telegram_user_id, employee_name.strip(), role, date)
+                for employee_name, role in employees
+            ]
+            if not rows:
+                return True
+
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    INSERT INTO employees (telegram_user_id, employee_name, role, last_mentioned_date)
-                    VALUES (?, ?, ?, ?)
-                    ON CONFLICT(telegram_user_id, employee_name, role)
-                    DO UPDATE SET last_mentioned_date = ?
-                """, (telegram_user_id, employee_name.strip(), role, date, date))
-            else:
-                cursor.execute("""
-                    INSERT INTO employees (telegram_user_id, employee_name, role, last_mentioned_date)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (telegram_user_id, employee_name, role)
-                    DO UPDATE SET last_mentioned_date = EXCLUDED.last_mentioned_date
-                """, (telegram_user_id, employee_name.strip(), role, date))
+            cursor.executemany(_q("""
+                INSERT INTO employees (telegram_user_id, employee_name, role, last_mentioned_date)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (telegram_user_id, employee_name, role)
+                DO UPDATE SET last_mentioned_date = EXCLUDED.last_mentioned_date
+            """), rows)
 
             conn.commit()
             conn.close()
 
-            logger.debug(f"✅ Employee added/updated: {employee_name} ({role})")
+            logger.debug(f"✅ Employees added/updated: {', '.join(f'{r[1]} ({r[2]})' for r in rows)}")
             return True
 
         except Exception as e:
-            logger.error(f"Failed to add employee: {e}")
+            logger.error(f"Failed to add employees: {e}")
             return False
 
     def get_employees(self, telegram_user_id: int, role: str = None) -> list:
@@ -3233,49 +3339,19 @@ class UserDatabase:
         Returns:
             List of employee dictionaries
         """
+        # One statement for both cases: a NULL role disables the filter
+        role = role or None
         conn = self._get_connection()
-
-        if role:
-            if DB_TYPE == "sqlite":
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, employee_name, role, last_mentioned_date, created_at
-                    FROM employees
-                    WHERE telegram_user_id = ? AND role = ?
-                    ORDER BY last_mentioned_date DESC, employee_name
-                """, (telegram_user_id, role))
-                rows = cursor.fetchall()
-            else:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("""
-                    SELECT id, employee_name, role, last_mentioned_date, created_at
-                    FROM employees
-                    WHERE telegram_user_id = %s AND role = %s
-                    ORDER BY last_mentioned_date DESC, employee_name
-                """, (telegram_user_id, role))
-                rows = cursor.fetchall()
-        else:
-            if DB_TYPE == "sqlite":
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, employee_name, role, last_mentioned_date, created_at
-                    FROM employees
-                    WHERE telegram_user_id = ?
-                    ORDER BY last_mentioned_date DESC, employee_name
-                """, (telegram_user_id,))
-                rows = cursor.fetchall()
-            else:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("""
-                    SELECT id, employee_name, role, last_mentioned_date, created_at
-                    FROM employees
-                    WHERE telegram_user_id = %s
-                    ORDER BY last_mentioned_date DESC, employee_name
-                """, (telegram_user_id,))
-                rows = cursor.fetchall()
-
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q("""
+            SELECT id, employee_name, role, last_mentioned_date, created_at
+            FROM employees
+            WHERE telegram_user_id = ? AND (? IS NULL OR role = ?)
+            ORDER BY last_mentioned_date DESC, employee_name
+        """), (telegram_user_id, role, role))
+        rows = cursor.fetchall()
         conn.close()
-        return [dict(row) for row in rows]
+        return _dict_rows(rows)
 
     # ==================== Expense Drafts Methods ====================
 
@@ -3306,7 +3382,7 @@ class UserDatabase:
                 else:
                     full_date_str = date_str
 
-            count = 0
+            rows = []
             for item in items:
                 # Поддержка как dict, так и объектов с атрибутами
                 if hasattr(item, 'amount'):
@@ -3326,36 +3402,20 @@ class UserDatabase:
                     unit = item.get('unit')
                     price_per_unit = item.get('price_per_unit')
 
-                if DB_TYPE == "sqlite":
-                    if full_date_str:
-                        cursor.execute("""
-                            INSERT INTO expense_drafts
-                            (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit, full_date_str))
-                    else:
-                        cursor.execute("""
-                            INSERT INTO expense_drafts
-                            (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit))
-                else:
-                    if full_date_str:
-                        cursor.execute("""
-                            INSERT INTO expense_drafts
-                            (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit, full_date_str))
-                    else:
-                        cursor.execute("""
-                            INSERT INTO expense_drafts
-                            (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit))
-                count += 1
+                row = (telegram_user_id, amount, description, expense_type, category, source, source_account, quantity, unit, price_per_unit)
+                # created_at falls back to the column default unless a date was given
+                rows.append(row + (full_date_str,) if full_date_str else row)
+
+            columns = ("telegram_user_id", "amount", "description", "expense_type", "category",
+                       "source", "source_account", "quantity", "unit", "price_per_unit")
+            if full_date_str:
+                columns += ("created_at",)
+            self._insert_many(cursor, "expense_drafts", columns, rows)
+            count = len(rows)
 
             conn.commit()
             conn.close()
+            self._no_pending_supply_cache.invalidate(telegram_user_id)
 
             logger.info(f"✅ Saved {count} expense drafts for user {telegram_user_id} on date {date_str or 'now'}")
             return count
@@ -3375,44 +3435,23 @@ class UserDatabase:
         Returns:
             Список черновиков
         """
-        conn = self._get_connection()
+        query = "SELECT * FROM expense_drafts WHERE telegram_user_id = ?"
+        params = [telegram_user_id]
+        if status != "all":
+            query += " AND status = ?"
+            params.append(status)
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            if status == "all":
-                cursor.execute("""
-                    SELECT * FROM expense_drafts
-                    WHERE telegram_user_id = ?
-                    ORDER BY created_at DESC
-                """, (telegram_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM expense_drafts
-                    WHERE telegram_user_id = ? AND status = ?
-                    ORDER BY created_at DESC
-                """, (telegram_user_id, status))
-            rows = cursor.fetchall()
-            # Convert to dict
-            columns = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(columns, row)) for row in rows]
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            if status == "all":
-                cursor.execute("""
-                    SELECT * FROM expense_drafts
-                    WHERE telegram_user_id = %s
-                    ORDER BY created_at DESC
-                """, (telegram_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM expense_drafts
-                    WHERE telegram_user_id = %s AND status = %s
-                    ORDER BY created_at DESC
-                """, (telegram_user_id, status))
-            rows = cursor.fetchall()
+        conn = self._get_connection()
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q(query + " ORDER BY created_at DESC"), params)
+        rows = _dict_rows(cursor.fetchall())
 
         conn.close()
-        return [dict(row) for row in rows]
+        return rows
+
+    def _invalidate_expense_drafts(self, draft_ids):
+        for draft_id in draft_ids:
+            self._expense_draft_cache.invalidate(int(draft_id))
 
     def get_expense_draft(self, draft_id: int) -> Optional[Dict]:
         """
@@ -3424,25 +3463,29 @@ class UserDatabase:
         Returns:
             Черновик или None
         """
+        cached = self._expense_draft_cache.get(draft_id)
+        if cached is not None:
+            return dict(cached)
+
+        generation = self._expense_draft_cache.generation
         conn = self._get_connection()
+        cursor = self._dict_cursor(conn)
 
         if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM expense_drafts WHERE id = ?", (draft_id,))
-            row = cursor.fetchone()
-            if row:
-                columns = [desc[0] for desc in cursor.description]
-                result = dict(zip(columns, row))
-            else:
-                result = None
+            cursor.execute(f"SELECT {_EXPENSE_DRAFT_COLUMNS} FROM expense_drafts WHERE id = ?", (draft_id,))
         else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT * FROM expense_drafts WHERE id = %s", (draft_id,))
-            row = cursor.fetchone()
-            result = dict(row) if row else None
+            # Opened on every draft edit in the web UI
+            self._execute_prepared(cursor, "get_expense_draft",
+                                   f"SELECT {_EXPENSE_DRAFT_COLUMNS} FROM expense_drafts WHERE id = $1", (draft_id,))
+        row = cursor.fetchone()
 
         conn.close()
-        return result
+
+        if row:
+            draft = dict(row)
+            self._expense_draft_cache.set(draft_id, draft, generation)
+            return dict(draft)
+        return None
 
     def update_expense_draft(self, draft_id: int, telegram_user_id: int = None, **kwargs) -> bool:
         """
@@ -3459,30 +3502,21 @@ class UserDatabase:
         if not kwargs:
             return False
 
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+        fields = tuple(sorted(kwargs))
+        where = "id = ?"
+        params = [kwargs[k] for k in fields] + [draft_id]
+        if telegram_user_id is not None:
+            where += " AND telegram_user_id = ?"
+            params.append(telegram_user_id)
 
-            # Build SET clause with optional ownership check
-            if DB_TYPE == "sqlite":
-                set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE expense_drafts SET {set_clause} WHERE id = ? AND telegram_user_id = ?"
-                    cursor.execute(query, list(kwargs.values()) + [draft_id, telegram_user_id])
-                else:
-                    query = f"UPDATE expense_drafts SET {set_clause} WHERE id = ?"
-                    cursor.execute(query, list(kwargs.values()) + [draft_id])
+        try:
+            self._execute(_update_sql("expense_drafts", fields, where), params)
+            self._expense_draft_cache.invalidate(draft_id)
+            # expense_type or status may have been switched to a pending supply
+            if telegram_user_id is None:
+                self._no_pending_supply_cache.clear()
             else:
-                set_clause = ", ".join([f"{k} = %s" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE expense_drafts SET {set_clause} WHERE id = %s AND telegram_user_id = %s"
-                    cursor.execute(query, list(kwargs.values()) + [draft_id, telegram_user_id])
-                else:
-                    query = f"UPDATE expense_drafts SET {set_clause} WHERE id = %s"
-                    cursor.execute(query, list(kwargs.values()) + [draft_id])
-
-            conn.commit()
-            conn.close()
+                self._no_pending_supply_cache.invalidate(telegram_user_id)
             return True
 
         except Exception as e:
@@ -3495,19 +3529,23 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
+            # One statement for both cases: a NULL owner skips the ownership check
             if DB_TYPE == "sqlite":
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM expense_drafts WHERE id = ? AND telegram_user_id = ?", (draft_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM expense_drafts WHERE id = ?", (draft_id,))
+                cursor.execute("""
+                    DELETE FROM expense_drafts
+                    WHERE id = ? AND (?2 IS NULL OR telegram_user_id = ?2)
+                """, (draft_id, telegram_user_id))
             else:
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM expense_drafts WHERE id = %s AND telegram_user_id = %s", (draft_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM expense_drafts WHERE id = %s", (draft_id,))
+                self._execute_prepared(cursor, "delete_expense_draft", """
+                    DELETE FROM expense_drafts
+                    WHERE id = $1 AND ($2::bigint IS NULL OR telegram_user_id = $2)
+                """, (draft_id, telegram_user_id))
 
             conn.commit()
             conn.close()
+            self._expense_draft_cache.invalidate(draft_id)
+            # ON DELETE SET NULL clears linked_expense_draft_id on supply drafts
+            self._supply_draft_cache.clear()
             return True
 
         except Exception as e:
@@ -3557,39 +3595,30 @@ class UserDatabase:
                 else:
                     full_created_at = created_at
 
-            if DB_TYPE == "sqlite":
-                if full_created_at:
-                    cursor.execute("""
-                        INSERT INTO expense_drafts
-                        (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income, completion_status, poster_amount, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income_int, completion_status, poster_amount, full_created_at))
-                else:
-                    cursor.execute("""
-                        INSERT INTO expense_drafts
-                        (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income, completion_status, poster_amount)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income_int, completion_status, poster_amount))
-                draft_id = cursor.lastrowid
-            else:
-                if full_created_at:
-                    cursor.execute("""
-                        INSERT INTO expense_drafts
-                        (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income, completion_status, poster_amount, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    """, (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income_int, completion_status, poster_amount, full_created_at))
-                else:
-                    cursor.execute("""
-                        INSERT INTO expense_drafts
-                        (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income, completion_status, poster_amount)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    """, (telegram_user_id, amount, description, expense_type, category, source, account_id, poster_account_id, poster_transaction_id, is_income_int, completion_status, poster_amount))
-                draft_id = cursor.fetchone()[0]
+            columns = [
+                "telegram_user_id", "amount", "description", "expense_type", "category", "source",
+                "account_id", "poster_account_id", "poster_transaction_id", "is_income",
+                "completion_status", "poster_amount",
+            ]
+            params = [
+                telegram_user_id, amount, description, expense_type, category, source,
+                account_id, poster_account_id, poster_transaction_id, is_income_int,
+                completion_status, poster_amount,
+            ]
+            if full_created_at:
+                columns.append("created_at")
+                params.append(full_created_at)
+
+            cursor.execute(_q(f"""
+                INSERT INTO expense_drafts ({', '.join(columns)})
+                VALUES ({', '.join('?' * len(columns))})
+                RETURNING id
+            """), params)
+            draft_id = cursor.fetchone()[0]
 
             conn.commit()
             conn.close()
+            self._no_pending_supply_cache.invalidate(telegram_user_id)
             logger.info(f"✅ Created expense draft #{draft_id} for user {telegram_user_id} (income={is_income})")
             return draft_id
 
@@ -3597,6 +3626,61 @@ class UserDatabase:
             logger.error(f"Failed to create expense draft: {e}")
             return None
 
+    def create_expense_drafts_bulk(self, telegram_user_id: int, drafts: list) -> int:
+        """
+        Создать несколько черновиков расходов одним INSERT и одним commit
+        (синхронизация транзакций из Poster)
+
+        Args:
+            drafts: Список dict с теми же полями, что у create_expense_draft
+                (amount, description, expense_type, category, source, account_id,
+                poster_account_id, poster_transaction_id, is_income,
+                completion_status, poster_amount)
+
+        Returns:
+            Количество созданных черновиков
+        """
+        if not drafts:
+            return 0
+
+        rows = [
+            (
+                telegram_user_id,
+                draft.get('amount', 0),
+                draft.get('description', ""),
+                draft.get('expense_type', "transaction"),
+                draft.get('category'),
+                draft.get('source', "cash"),
+                draft.get('account_id'),
+                draft.get('poster_account_id'),
+                draft.get('poster_transaction_id'),
+                1 if draft.get('is_income') else 0,
+                draft.get('completion_status', "pending"),
+                draft.get('poster_amount'),
+            )
+            for draft in drafts
+        ]
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            self._insert_many(cursor, "expense_drafts", (
+                "telegram_user_id", "amount", "description", "expense_type", "category", "source",
+                "account_id", "poster_account_id", "poster_transaction_id", "is_income",
+                "completion_status", "poster_amount",
+            ), rows)
+
+            conn.commit()
+            conn.close()
+            self._no_pending_supply_cache.invalidate(telegram_user_id)
+            logger.info(f"✅ Created {len(rows)} expense drafts for user {telegram_user_id}")
+            return len(rows)
+
+        except Exception as e:
+            logger.error(f"Failed to create expense drafts: {e}")
+            return 0
+
     def get_expense_draft_by_poster_transaction_id(self, poster_transaction_id: str) -> Optional[dict]:
         """Check if a draft with given poster_transaction_id exists"""
         try:
@@ -3634,22 +3718,17 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                placeholders = ",".join(["?" for _ in draft_ids])
-                if telegram_user_id is not None:
-                    cursor.execute(f"DELETE FROM expense_drafts WHERE id IN ({placeholders}) AND telegram_user_id = ?", draft_ids + [telegram_user_id])
-                else:
-                    cursor.execute(f"DELETE FROM expense_drafts WHERE id IN ({placeholders})", draft_ids)
-            else:
-                placeholders = ",".join(["%s" for _ in draft_ids])
-                if telegram_user_id is not None:
-                    cursor.execute(f"DELETE FROM expense_drafts WHERE id IN ({placeholders}) AND telegram_user_id = %s", draft_ids + [telegram_user_id])
-                else:
-                    cursor.execute(f"DELETE FROM expense_drafts WHERE id IN ({placeholders})", draft_ids)
+            cursor.execute(_q(f"""
+                DELETE FROM expense_drafts
+                WHERE id {_IN_ID_LIST}
+                  AND (? IS NULL OR telegram_user_id = ?)
+            """), (_id_list(draft_ids), telegram_user_id, telegram_user_id))
 
             deleted = cursor.rowcount
             conn.commit()
             conn.close()
+            self._invalidate_expense_drafts(draft_ids)
+            self._supply_draft_cache.clear()
             return deleted
 
         except Exception as e:
@@ -3661,28 +3740,20 @@ class UserDatabase:
         if not draft_ids:
             return 0
 
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                placeholders = ",".join(["?" for _ in draft_ids])
-                cursor.execute(f"""
-                    UPDATE expense_drafts
-                    SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                    WHERE id IN ({placeholders})
-                """, draft_ids)
-            else:
-                placeholders = ",".join(["%s" for _ in draft_ids])
-                cursor.execute(f"""
-                    UPDATE expense_drafts
-                    SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                    WHERE id IN ({placeholders})
-                """, draft_ids)
-
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute(_q(f"""
+                UPDATE expense_drafts
+                SET status = 'processed', processed_at = CURRENT_TIMESTAMP
+                WHERE id {_IN_ID_LIST}
+            """), (_id_list(draft_ids),))
+
             updated = cursor.rowcount
             conn.commit()
             conn.close()
+            self._invalidate_expense_drafts(draft_ids)
             return updated
 
         except Exception as e:
@@ -3701,24 +3772,16 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                placeholders = ",".join(["?" for _ in draft_ids])
-                cursor.execute(f"""
-                    UPDATE expense_drafts
-                    SET completion_status = 'completed'
-                    WHERE id IN ({placeholders})
-                """, draft_ids)
-            else:
-                placeholders = ",".join(["%s" for _ in draft_ids])
-                cursor.execute(f"""
-                    UPDATE expense_drafts
-                    SET completion_status = 'completed'
-                    WHERE id IN ({placeholders})
-                """, draft_ids)
+            cursor.execute(_q(f"""
+                UPDATE expense_drafts
+                SET completion_status = 'completed'
+                WHERE id {_IN_ID_LIST}
+            """), (_id_list(draft_ids),))
 
             updated = cursor.rowcount
             conn.commit()
             conn.close()
+            self._invalidate_expense_drafts(draft_ids)
             logger.info(f"✅ Marked {updated} drafts as in Poster (staying visible)")
             return updated
 
@@ -3732,17 +3795,15 @@ class UserDatabase:
         """Get shift reconciliation data for a specific date (all sources)"""
         try:
             conn = self._get_connection()
-            cursor = conn.cursor()
+            cursor = self._dict_cursor(conn)
 
-            placeholder = "?" if DB_TYPE == "sqlite" else "%s"
-            cursor.execute(f"""
+            cursor.execute(_q("""
                 SELECT * FROM shift_reconciliation
-                WHERE telegram_user_id = {placeholder} AND date = {placeholder}
+                WHERE telegram_user_id = ? AND date = ?
                 ORDER BY source
-            """, (telegram_user_id, date))
+            """), (telegram_user_id, date))
 
-            columns = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            rows = _dict_rows(cursor.fetchall())
             conn.close()
             return rows
 
@@ -4198,7 +4259,7 @@ class UserDatabase:
                     WHERE telegram_user_id = %s
                     ORDER BY sort_order, id
                 """, (telegram_user_id,))
-                result = [dict(row) for row in cursor.fetchall()]
+                result = cursor.fetchall()
             conn.close()
             return result
         except Exception as e:
@@ -4906,43 +4967,49 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            # Insert supply draft
+            draft_values = (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source)
+
+            item_rows = []
+            for item in items:
+                quantity = float(item.get('quantity') or 1)
+                price_per_unit = float(item.get('price') or 0)
+                total = float(item.get('total') or 0) or (quantity * price_per_unit)
+                item_rows.append((item.get('name', ''), quantity, item.get('unit', 'шт'), price_per_unit, total))
+
             if DB_TYPE == "sqlite":
                 cursor.execute("""
                     INSERT INTO supply_drafts
                     (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source))
-                supply_draft_id = cursor.lastrowid
-            else:
-                cursor.execute("""
-                    INSERT INTO supply_drafts
-                    (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
-                """, (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source))
+                """, draft_values)
                 supply_draft_id = cursor.fetchone()[0]
 
-            # Insert supply draft items
-            for item in items:
-                item_name = item.get('name', '')
-                quantity = float(item.get('quantity') or 1)
-                unit = item.get('unit', 'шт')
-                price_per_unit = float(item.get('price') or 0)
-                total = float(item.get('total') or 0) or (quantity * price_per_unit)
-
-                if DB_TYPE == "sqlite":
-                    cursor.execute("""
-                        INSERT INTO supply_draft_items
-                        (supply_draft_id, item_name, quantity, unit, price_per_unit, total)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (supply_draft_id, item_name, quantity, unit, price_per_unit, total))
-                else:
-                    cursor.execute("""
+                self._insert_many(cursor, "supply_draft_items", (
+                    "supply_draft_id", "item_name", "quantity", "unit", "price_per_unit", "total"
+                ), [(supply_draft_id,) + row for row in item_rows])
+            else:
+                # Draft and its items in one round-trip: the items are passed as
+                # parallel arrays and unnested against the id the CTE returns
+                names, quantities, units, prices, totals = (
+                    [list(column) for column in zip(*item_rows)] if item_rows else ([], [], [], [], [])
+                )
+                cursor.execute("""
+                    WITH draft AS (
+                        INSERT INTO supply_drafts
+                        (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, ocr_text, account_id, source)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    ), draft_items AS (
                         INSERT INTO supply_draft_items
                         (supply_draft_id, item_name, quantity, unit, price_per_unit, total)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (supply_draft_id, item_name, quantity, unit, price_per_unit, total))
+                        SELECT draft.id, v.item_name, v.quantity, v.unit, v.price_per_unit, v.total
+                        FROM draft, unnest(%s::text[], %s::numeric[], %s::text[], %s::numeric[], %s::numeric[])
+                            AS v(item_name, quantity, unit, price_per_unit, total)
+                    )
+                    SELECT id FROM draft
+                """, draft_values + (names, quantities, units, prices, totals))
+                supply_draft_id = cursor.fetchone()[0]
 
             conn.commit()
             conn.close()
@@ -4980,22 +5047,13 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    INSERT INTO supply_drafts
-                    (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id))
-                supply_draft_id = cursor.lastrowid
-            else:
-                cursor.execute("""
-                    INSERT INTO supply_drafts
-                    (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id))
-                supply_draft_id = cursor.fetchone()[0]
-
+            cursor.execute(_q("""
+                INSERT INTO supply_drafts
+                (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """), (telegram_user_id, supplier_name, invoice_date, total_sum, linked_expense_draft_id, account_id, source, supplier_id))
+            supply_draft_id = cursor.fetchone()[0]
 
             conn.commit()
             conn.close()
@@ -5018,29 +5076,16 @@ class UserDatabase:
         if not kwargs:
             return False
 
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE supply_drafts SET {set_clause} WHERE id = ? AND telegram_user_id = ?"
-                    cursor.execute(query, list(kwargs.values()) + [supply_draft_id, telegram_user_id])
-                else:
-                    query = f"UPDATE supply_drafts SET {set_clause} WHERE id = ?"
-                    cursor.execute(query, list(kwargs.values()) + [supply_draft_id])
-            else:
-                set_clause = ", ".join([f"{k} = %s" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE supply_drafts SET {set_clause} WHERE id = %s AND telegram_user_id = %s"
-                    cursor.execute(query, list(kwargs.values()) + [supply_draft_id, telegram_user_id])
-                else:
-                    query = f"UPDATE supply_drafts SET {set_clause} WHERE id = %s"
-                    cursor.execute(query, list(kwargs.values()) + [supply_draft_id])
+        fields = tuple(sorted(kwargs))
+        where = "id = ?"
+        params = [kwargs[k] for k in fields] + [supply_draft_id]
+        if telegram_user_id is not None:
+            where += " AND telegram_user_id = ?"
+            params.append(telegram_user_id)
 
-            conn.commit()
-            conn.close()
+        try:
+            self._execute(_update_sql("supply_drafts", fields, where), params)
+            self._supply_draft_cache.invalidate(supply_draft_id)
             return True
 
         except Exception as e:
@@ -5077,33 +5122,21 @@ class UserDatabase:
             cursor = conn.cursor()
             total = quantity * price_per_unit
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    INSERT INTO supply_draft_items
-                    (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
-                     poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
-                     item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
-                      poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
-                      item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit))
-                item_id = cursor.lastrowid
-            else:
-                cursor.execute("""
-                    INSERT INTO supply_draft_items
-                    (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
-                     poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
-                     item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
-                      poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
-                      item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit))
-                item_id = cursor.fetchone()[0]
-
+            cursor.execute(_q("""
+                INSERT INTO supply_draft_items
+                (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
+                 poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
+                 item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """), (supply_draft_id, item_name, quantity, unit, price_per_unit, total,
+                  poster_ingredient_id, poster_ingredient_name, poster_account_id, poster_account_name,
+                  item_type, storage_id, storage_name, parsed_quantity, parsed_unit, parsed_price_per_unit))
+            item_id = cursor.fetchone()[0]
 
             conn.commit()
             conn.close()
+            self._supply_draft_cache.invalidate(supply_draft_id)
             return item_id
 
         except Exception as e:
@@ -5112,23 +5145,15 @@ class UserDatabase:
 
     def delete_supply_draft_item(self, item_id: int, telegram_user_id: int = None) -> bool:
         """Удалить позицию из черновика поставки. Если telegram_user_id передан — проверяет через supply_drafts."""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM supply_draft_items WHERE id = ? AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = ?)", (item_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM supply_draft_items WHERE id = ?", (item_id,))
-            else:
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM supply_draft_items WHERE id = %s AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = %s)", (item_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM supply_draft_items WHERE id = %s", (item_id,))
+        where = "id = ?"
+        params = [item_id]
+        if telegram_user_id is not None:
+            where += " AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = ?)"
+            params.append(telegram_user_id)
 
-            conn.commit()
-            conn.close()
+        try:
+            self._execute(f"DELETE FROM supply_draft_items WHERE {where}", params)
+            self._supply_draft_cache.clear()
             return True
 
         except Exception as e:
@@ -5138,16 +5163,8 @@ class UserDatabase:
     def clear_supply_draft_items(self, supply_draft_id: int) -> bool:
         """Удалить все позиции из черновика поставки."""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                cursor.execute("DELETE FROM supply_draft_items WHERE supply_draft_id = ?", (supply_draft_id,))
-            else:
-                cursor.execute("DELETE FROM supply_draft_items WHERE supply_draft_id = %s", (supply_draft_id,))
-
-            conn.commit()
-            conn.close()
+            self._execute("DELETE FROM supply_draft_items WHERE supply_draft_id = ?", (supply_draft_id,))
+            self._supply_draft_cache.invalidate(supply_draft_id)
             return True
         except Exception as e:
             logger.error(f"Failed to clear supply draft items for draft {supply_draft_id}: {e}")
@@ -5164,43 +5181,19 @@ class UserDatabase:
         Returns:
             Список черновиков поставок
         """
-        conn = self._get_connection()
+        query = f"SELECT {_SUPPLY_DRAFT_COLUMNS} FROM supply_drafts WHERE telegram_user_id = ?"
+        params = [telegram_user_id]
+        if status != "all":
+            query += " AND status = ?"
+            params.append(status)
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            if status == "all":
-                cursor.execute("""
-                    SELECT * FROM supply_drafts
-                    WHERE telegram_user_id = ?
-                    ORDER BY created_at DESC
-                """, (telegram_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM supply_drafts
-                    WHERE telegram_user_id = ? AND status = ?
-                    ORDER BY created_at DESC
-                """, (telegram_user_id, status))
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(columns, row)) for row in rows]
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            if status == "all":
-                cursor.execute("""
-                    SELECT * FROM supply_drafts
-                    WHERE telegram_user_id = %s
-                    ORDER BY created_at DESC
-                """, (telegram_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM supply_drafts
-                    WHERE telegram_user_id = %s AND status = %s
-                    ORDER BY created_at DESC
-                """, (telegram_user_id, status))
-            rows = cursor.fetchall()
+        conn = self._get_connection()
+        cursor = self._dict_cursor(conn)
+        cursor.execute(_q(query + " ORDER BY created_at DESC"), params)
+        rows = _dict_rows(cursor.fetchall())
 
         conn.close()
-        return [dict(row) for row in rows]
+        return rows
 
     def get_supply_draft_with_items(self, supply_draft_id: int) -> Optional[Dict]:
         """
@@ -5212,50 +5205,54 @@ class UserDatabase:
         Returns:
             Черновик поставки с items или None
         """
-        conn = self._get_connection()
+        cached = self._supply_draft_cache.get(supply_draft_id)
+        if cached is not None:
+            return copy.deepcopy(cached)
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
+        generation = self._supply_draft_cache.generation
+        draft = self.get_supply_drafts_with_items([supply_draft_id]).get(supply_draft_id)
+        if draft is None:
+            return None
+        self._supply_draft_cache.set(supply_draft_id, draft, generation)
+        return copy.deepcopy(draft)
 
-            # Get supply draft
-            cursor.execute("SELECT * FROM supply_drafts WHERE id = ?", (supply_draft_id,))
-            draft_row = cursor.fetchone()
-            if not draft_row:
-                conn.close()
-                return None
+    def get_supply_drafts_with_items(self, supply_draft_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Получить несколько черновиков поставки с позициями за два запроса
 
-            columns = [desc[0] for desc in cursor.description]
-            draft = dict(zip(columns, draft_row))
+        Списки черновиков в веб-интерфейсе раньше запрашивали позиции
+        каждого черновика отдельно (1 + 2N запросов).
 
-            # Get items
-            cursor.execute("""
-                SELECT * FROM supply_draft_items
-                WHERE supply_draft_id = ?
-                ORDER BY id
-            """, (supply_draft_id,))
-            item_rows = cursor.fetchall()
-            item_columns = [desc[0] for desc in cursor.description]
-            draft['items'] = [dict(zip(item_columns, row)) for row in item_rows]
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        Args:
+            supply_draft_ids: ID черновиков поставки
 
-            cursor.execute("SELECT * FROM supply_drafts WHERE id = %s", (supply_draft_id,))
-            draft_row = cursor.fetchone()
-            if not draft_row:
-                conn.close()
-                return None
+        Returns:
+            {id: черновик поставки с items}; несуществующие ID пропускаются
+        """
+        ids = list(dict.fromkeys(supply_draft_ids))
+        if not ids:
+            return {}
 
-            draft = dict(draft_row)
+        conn = self._get_connection()
+        cursor = self._dict_cursor(conn)
 
-            cursor.execute("""
+        cursor.execute(_q(f"SELECT {_SUPPLY_DRAFT_COLUMNS} FROM supply_drafts WHERE id {_IN_ID_LIST}"), (_id_list(ids),))
+        drafts = {}
+        for draft in _dict_rows(cursor.fetchall()):
+            draft['items'] = []
+            drafts[draft['id']] = draft
+
+        if drafts:
+            cursor.execute(_q(f"""
                 SELECT * FROM supply_draft_items
-                WHERE supply_draft_id = %s
+                WHERE supply_draft_id {_IN_ID_LIST}
                 ORDER BY id
-            """, (supply_draft_id,))
-            draft['items'] = [dict(row) for row in cursor.fetchall()]
+            """), (_id_list(ids),))
+            for item in _dict_rows(cursor.fetchall()):
+                drafts[item['supply_draft_id']]['items'].append(item)
 
         conn.close()
-        return draft
+        return drafts
 
     def update_supply_draft_item(self, item_id: int, telegram_user_id: int = None, **kwargs) -> bool:
         """
@@ -5272,29 +5269,17 @@ class UserDatabase:
         if not kwargs:
             return False
 
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE supply_draft_items SET {set_clause} WHERE id = ? AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = ?)"
-                    cursor.execute(query, list(kwargs.values()) + [item_id, telegram_user_id])
-                else:
-                    query = f"UPDATE supply_draft_items SET {set_clause} WHERE id = ?"
-                    cursor.execute(query, list(kwargs.values()) + [item_id])
-            else:
-                set_clause = ", ".join([f"{k} = %s" for k in kwargs.keys()])
-                if telegram_user_id is not None:
-                    query = f"UPDATE supply_draft_items SET {set_clause} WHERE id = %s AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = %s)"
-                    cursor.execute(query, list(kwargs.values()) + [item_id, telegram_user_id])
-                else:
-                    query = f"UPDATE supply_draft_items SET {set_clause} WHERE id = %s"
-                    cursor.execute(query, list(kwargs.values()) + [item_id])
+        fields = tuple(sorted(kwargs))
+        where = "id = ?"
+        params = [kwargs[k] for k in fields] + [item_id]
+        if telegram_user_id is not None:
+            where += " AND supply_draft_id IN (SELECT id FROM supply_drafts WHERE telegram_user_id = ?)"
+            params.append(telegram_user_id)
 
-            conn.commit()
-            conn.close()
+        try:
+            self._execute(_update_sql("supply_draft_items", fields, where), params)
+            # Only the item id is known here, not its draft
+            self._supply_draft_cache.clear()
             return True
 
         except Exception as e:
@@ -5303,55 +5288,69 @@ class UserDatabase:
 
     def delete_supply_draft(self, supply_draft_id: int, telegram_user_id: int = None) -> bool:
         """Удалить черновик поставки (вместе с позициями благодаря CASCADE). Если telegram_user_id передан — проверяет принадлежность."""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if DB_TYPE == "sqlite":
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM supply_drafts WHERE id = ? AND telegram_user_id = ?", (supply_draft_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM supply_drafts WHERE id = ?", (supply_draft_id,))
-            else:
-                if telegram_user_id is not None:
-                    cursor.execute("DELETE FROM supply_drafts WHERE id = %s AND telegram_user_id = %s", (supply_draft_id, telegram_user_id))
-                else:
-                    cursor.execute("DELETE FROM supply_drafts WHERE id = %s", (supply_draft_id,))
+        where = "id = ?"
+        params = [supply_draft_id]
+        if telegram_user_id is not None:
+            where += " AND telegram_user_id = ?"
+            params.append(telegram_user_id)
 
-            conn.commit()
-            conn.close()
+        try:
+            self._execute(f"DELETE FROM supply_drafts WHERE {where}", params)
+            self._supply_draft_cache.invalidate(supply_draft_id)
             return True
 
         except Exception as e:
             logger.error(f"Failed to delete supply draft: {e}")
             return False
 
-    def mark_supply_draft_processed(self, supply_draft_id: int) -> bool:
-        """Пометить черновик поставки как обработанный"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+    def mark_supply_draft_processed(self, supply_draft_id: int, linked_expense_draft_id: int = None) -> bool:
+        """
+        Пометить черновик поставки как обработанный
 
-            if DB_TYPE == "sqlite":
-                cursor.execute("""
-                    UPDATE supply_drafts
-                    SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (supply_draft_id,))
-            else:
-                cursor.execute("""
+        Args:
+            supply_draft_id: ID черновика поставки
+            linked_expense_draft_id: ID связанного черновика расхода — помечается
+                обработанным в той же транзакции (один commit вместо двух)
+        """
+        return self.mark_supply_drafts_processed([supply_draft_id], [linked_expense_draft_id]) > 0
+
+    def mark_supply_drafts_processed(self, supply_draft_ids: list, linked_expense_draft_ids: list = ()) -> int:
+        """
+        Пометить несколько черновиков поставок (и связанные черновики расходов)
+        обработанными: по одному UPDATE на таблицу и один commit
+
+        Returns:
+            Количество обновлённых черновиков поставок
+        """
+        if not supply_draft_ids:
+            return 0
+
+        linked_expense_draft_ids = [i for i in linked_expense_draft_ids if i]
+
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(_q(f"""
                     UPDATE supply_drafts
                     SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                """, (supply_draft_id,))
-
-            conn.commit()
-            conn.close()
-            return True
+                    WHERE id {_IN_ID_LIST}
+                """), (_id_list(supply_draft_ids),))
+                updated = cursor.rowcount
+
+                if linked_expense_draft_ids:
+                    cursor.execute(_q(f"""
+                        UPDATE expense_drafts
+                        SET status = 'processed', processed_at = CURRENT_TIMESTAMP
+                        WHERE id {_IN_ID_LIST}
+                    """), (_id_list(linked_expense_draft_ids),))
+
+            for supply_draft_id in supply_draft_ids:
+                self._supply_draft_cache.invalidate(int(supply_draft_id))
+            self._invalidate_expense_drafts(linked_expense_draft_ids)
+            return updated
 
         except Exception as e:
-            logger.error(f"Failed to mark supply draft processed: {e}")
-            return False
+            logger.error(f"Failed to mark supply drafts processed: {e}")
+            return 0
 
     def get_pending_supply_items(self, telegram_user_id: int) -> list:
         """
@@ -5360,30 +5359,37 @@ class UserDatabase:
 
         Returns:
             Список pending расходов с expense_type='supply'
+            (только поля, нужные для выбора расхода: id, amount, description, source, created_at)
         """
-        conn = self._get_connection()
+        if self._no_pending_supply_cache.get(telegram_user_id):
+            return []
 
-        if DB_TYPE == "sqlite":
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM expense_drafts
-                WHERE telegram_user_id = ? AND status = 'pending' AND expense_type = 'supply'
-                ORDER BY created_at DESC
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(columns, row)) for row in rows]
-        else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM expense_drafts
-                WHERE telegram_user_id = %s AND status = 'pending' AND expense_type = 'supply'
-                ORDER BY created_at DESC
-            """, (telegram_user_id,))
-            rows = cursor.fetchall()
+        generation = self._no_pending_supply_cache.generation
+        conn = self._get_connection()
+        try:
+            if DB_TYPE == "sqlite":
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, amount, description, source, created_at FROM expense_drafts
+                    WHERE telegram_user_id = ? AND status = 'pending' AND expense_type = 'supply'
+                    ORDER BY created_at DESC
+                """, (telegram_user_id,))
+                rows = _dict_rows(cursor.fetchall())
+            else:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                # Runs on every supplies page load and supply-mode start
+                self._execute_prepared(cursor, "get_pending_supply_items", """
+                    SELECT id, amount, description, source, created_at FROM expense_drafts
+                    WHERE telegram_user_id = $1 AND status = 'pending' AND expense_type = 'supply'
+                    ORDER BY created_at DESC
+                """, (telegram_user_id,))
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
 
-        conn.close()
-        return [dict(row) for row in rows]
+        if not rows:
+            self._no_pending_supply_cache.set(telegram_user_id, True, generation)
+        return rows
 
     def _migrate_assistant_chat(self):
         """Create assistant_chat_messages table for conversational interface"""
@@ -5416,25 +5422,19 @@ class UserDatabase:
                         FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
                     )
                 """)
+            # Tables created before model_name existed
+            added = self._add_missing_columns(cursor, "assistant_chat_messages", [
+                ("model_name", "TEXT DEFAULT NULL"),
+            ])
             conn.commit()
             conn.close()
             logger.info("✅ Created assistant_chat_messages table")
-
-            # Migration: add model_name column if it does not exist
-            try:
-                conn = self._get_connection()
-                cursor = conn.cursor()
-                if DB_TYPE == "sqlite":
-                    cursor.execute("ALTER TABLE assistant_chat_messages ADD COLUMN model_name TEXT DEFAULT NULL")
-                else:
-                    cursor.execute("ALTER TABLE assistant_chat_messages ADD COLUMN IF NOT EXISTS model_name TEXT DEFAULT NULL")
-                conn.commit()
-                conn.close()
+            if added:
                 logger.info("✅ Migrated assistant_chat_messages: added model_name column")
-            except Exception as e:
-                pass
+            return True
         except Exception as e:
             logger.error(f"❌ Failed to create assistant_chat_messages table: {e}")
+            return False
 
     def _migrate_assistant_memory(self):
         """Create assistant_memory table for storing user-specific notes and rules"""
@@ -5462,8 +5462,10 @@ class UserDatabase:
             conn.commit()
             conn.close()
             logger.info("✅ Created assistant_memory table")
+            return True
         except Exception as e:
             logger.error(f"❌ Failed to create assistant_memory table: {e}")
+            return False
 
     def _migrate_assistant_memory_versions(self):
         """Create assistant_memory_versions table for storing last N versions with rollback."""
@@ -5492,8 +5494,10 @@ class UserDatabase:
                 """)
             conn.commit()
             conn.close()
+            return True
         except Exception as e:
             logger.error(f"❌ Failed to create assistant_memory_versions table: {e}")
+            return False
 
     def get_assistant_memory(self, telegram_user_id: int) -> str:
         """Get assistant memory text for the user"""
@@ -5606,7 +5610,7 @@ class UserDatabase:
             conn.close()
             if DB_TYPE == "sqlite":
                 return [{'id': r[0], 'memory_text': r[1], 'saved_at': r[2]} for r in rows]
-            return [dict(r) for r in rows]
+            return rows
         except Exception as e:
             logger.error(f"Error fetching memory versions: {e}")
             return []
@@ -5665,7 +5669,6 @@ class UserDatabase:
         results.reverse()
         
         # Deserialize JSON media_paths if present and convert timestamps to Almaty TZ
-        import json
         from datetime import datetime
         import pytz
         kz_tz = pytz.timezone('Asia/Almaty')
@@ -5704,7 +5707,6 @@ class UserDatabase:
 
     def add_assistant_chat_message(self, telegram_user_id: int, sender: str, message_text: str, media_paths: Optional[list] = None, model_name: Optional[str] = None) -> int:
         """Add a new chat message to the assistant history"""
-        import json
         media_json = json.dumps(media_paths or [])
         
         conn = self._get_connection()
@@ -5802,21 +5804,43 @@ class UserDatabase:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            try:
-                if DB_TYPE != "sqlite":
-                    cursor.execute("SAVEPOINT migration_wedrink_sp")
-                cursor.execute("ALTER TABLE shift_closings ADD COLUMN wedrink_sales REAL DEFAULT 0")
-                if DB_TYPE != "sqlite":
-                    cursor.execute("RELEASE SAVEPOINT migration_wedrink_sp")
+            if self._add_missing_columns(cursor, "shift_closings", [("wedrink_sales", "REAL DEFAULT 0")]):
                 logger.info("✅ WeDrink migration: added wedrink_sales to shift_closings")
-            except Exception:
-                if DB_TYPE != "sqlite":
-                    cursor.execute("ROLLBACK TO SAVEPOINT migration_wedrink_sp")
 
             conn.commit()
             conn.close()
+            return True
         except Exception as e:
             logger.error(f"WeDrink migration error: {e}")
+            return False
+
+    def _migrate_shipment_templates_jsonb(self):
+        """Convert shipment_templates.items from TEXT to JSONB on PostgreSQL"""
+        if DB_TYPE == "sqlite":
+            return True
+
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'shipment_templates' AND column_name = 'items'
+            """)
+            row = cursor.fetchone()
+            if row and row[0] == 'text':
+                cursor.execute("""
+                    ALTER TABLE shipment_templates
+                    ALTER COLUMN items TYPE JSONB USING items::jsonb
+                """)
+                logger.info("✅ Shipment templates migration: items converted to JSONB")
+
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error(f"Shipment templates JSONB migration error: {e}")
+            return False
 
 
 # Singleton instance
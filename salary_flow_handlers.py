@@ -1,5 +1,6 @@
 """Обработчики диалога расчета зарплат в 21:30"""
 import re
+import asyncio
 import logging
 from datetime import datetime
 from typing import Dict, Optional
@@ -66,17 +67,14 @@ async def save_mentioned_employees(
     db = get_database()
     today = datetime.now().strftime("%Y-%m-%d")
 
-    # Сохранить кассиров
-    for cashier_name in cashiers:
-        db.add_employee(telegram_user_id, cashier_name, 'cashier', today)
-
-    # Сохранить донерщика
+    employees = [(cashier_name, 'cashier') for cashier_name in cashiers]
     if doner:
-        db.add_employee(telegram_user_id, doner, 'doner_maker', today)
-
-    # Сохранить помощника
+        employees.append((doner, 'doner_maker'))
     if assistant:
-        db.add_employee(telegram_user_id, assistant, 'assistant', today)
+        employees.append((assistant, 'assistant'))
+
+    # Одна транзакция в отдельном потоке, чтобы не блокировать event loop
+    await asyncio.to_thread(db.add_employees, telegram_user_id, employees, today)
 
     logger.info(f"✅ Сохранены сотрудники для пользователя {telegram_user_id}")
 
@@ -0,0 +1,146 @@
+"""Tests for bulk ingredient alias maintenance"""
+import pytest
+
+from tests.conftest import TEST_USER_ID
+
+ALIASES = ["тестовый сыр", "тестовый соус"]
+
+
+@pytest.fixture(autouse=True)
+def cleanup_aliases(db):
+    """Remove test aliases before and after each test"""
+    for alias in ALIASES:
+        db.delete_ingredient_alias(TEST_USER_ID, alias)
+    yield
+    for alias in ALIASES:
+        db.delete_ingredient_alias(TEST_USER_ID, alias)
+
+
+def _aliases(db):
+    """Test aliases currently stored, as {alias_text: poster_item_id}"""
+    return {
+        a['alias_text']: a['poster_item_id']
+        for a in db.get_ingredient_aliases(TEST_USER_ID)
+        if a['alias_text'] in ALIASES
+    }
+
+
+def test_bulk_add_aliases(db):
+    """All aliases land, normalized to lower case"""
+    count = db.bulk_add_aliases(TEST_USER_ID, [
+        {'alias_text': ' Тестовый Сыр ', 'poster_item_id': 1, 'poster_item_name': 'Сыр'},
+        {'alias_text': 'тестовый соус', 'poster_item_id': 2, 'poster_item_name': 'Соус'},
+    ])
+
+    assert count == 2
+    assert _aliases(db) == {'тестовый сыр': 1, 'тестовый соус': 2}
+
+
+def test_bulk_add_aliases_duplicate_last_wins(db):
+    """A repeated alias (existing or within the batch) is updated to the last value"""
+    db.add_ingredient_alias(TEST_USER_ID, 'тестовый сыр', 1, 'Сыр')
+
+    db.bulk_add_aliases(TEST_USER_ID, [
+        {'alias_text': 'тестовый сыр', 'poster_item_id': 5, 'poster_item_name': 'Сыр 2'},
+        {'alias_text': 'ТЕСТОВЫЙ СЫР', 'poster_item_id': 7, 'poster_item_name': 'Сыр 3'},
+    ])
+
+    assert _aliases(db) == {'тестовый сыр': 7}
+
+
+def test_clean_orphaned_aliases(db):
+    """Aliases pointing at ingredients missing from Poster are deleted, the rest kept"""
+    db.bulk_add_aliases(TEST_USER_ID, [
+        {'alias_text': 'тестовый сыр', 'poster_item_id': 900001, 'poster_item_name': 'Сыр'},
+        {'alias_text': 'тестовый соус', 'poster_item_id': 900002, 'poster_item_name': 'Соус'},
+    ])
+    other_ids = [
+        a['poster_item_id'] for a in db.get_ingredient_aliases(TEST_USER_ID)
+        if a['alias_text'] not in ALIASES
+    ]
+
+    deleted = db.clean_orphaned_ingredient_aliases(TEST_USER_ID, other_ids + ['900001'])
+
+    assert deleted == 1
+    assert _aliases(db) == {'тестовый сыр': 900001}
+
+
+def test_add_alias_returns_stable_id(db):
+    """add_ingredient_alias returns the row id, which an update keeps"""
+    alias_id = db.add_ingredient_alias(TEST_USER_ID, 'тестовый сыр', 1, 'Сыр')
+    assert alias_id
+
+    assert db.add_ingredient_alias(TEST_USER_ID, 'тестовый сыр', 2, 'Сыр 2') == alias_id
+    assert db.get_alias_by_id(alias_id, TEST_USER_ID)['poster_item_id'] == 2
+
+
+def test_bulk_add_aliases_accepts_generator(db):
+    """bulk_add_aliases consumes any iterable, not only lists"""
+    count = db.bulk_add_aliases(TEST_USER_ID, (
+        {'alias_text': alias, 'poster_item_id': n, 'poster_item_name': alias}
+        for n, alias in enumerate(ALIASES, start=1)
+    ))
+
+    assert count == 2
+    assert _aliases(db) == {'тестовый сыр': 1, 'тестовый соус': 2}
+
+
+def test_supplier_alias_roundtrip(db):
+    """add_supplier_alias upserts by alias text; delete_supplier_alias removes by id"""
+    db.add_supplier_alias(TEST_USER_ID, ' Тестовый Сыр ', 1, 'ИП Сыр')
+    db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр', 2, 'ИП Сыр 2')
+
+    matches = [a for a in db.get_supplier_aliases(TEST_USER_ID) if a['alias_text'] == 'тестовый сыр']
+    assert len(matches) == 1
+    assert matches[0]['poster_supplier_id'] == 2
+
+    db.delete_supplier_alias(TEST_USER_ID, matches[0]['id'])
+
+    assert not [a for a in db.get_supplier_aliases(TEST_USER_ID) if a['alias_text'] == 'тестовый сыр']
+
+
+def test_get_supplier_by_alias(db):
+    """Exact matches win over partial ones; partial matches work both ways"""
+    db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр', 1, 'ИП Сыр')
+    db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр 100%', 2, 'ИП Сыр 100')
+    try:
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'Тестовый сыр')['poster_supplier_id'] == 1
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр 100%')['poster_supplier_id'] == 2
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'оплата тестовый сыр kaspi')['poster_supplier_id'] == 1
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'сыр 100')['poster_supplier_id'] == 2
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый_творог') is None
+    finally:
+        for alias in db.get_supplier_aliases(TEST_USER_ID):
+            if alias['alias_text'].startswith('тестовый сыр'):
+                db.delete_supplier_alias(TEST_USER_ID, alias['id'])
+
+
+def test_get_supplier_by_alias_sees_new_alias(db):
+    """A cached resolution is dropped when a better-matching alias is added"""
+    db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр', 1, 'ИП Сыр')
+    try:
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр kaspi')['poster_supplier_id'] == 1
+
+        db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр kaspi', 2, 'ИП Сыр Kaspi')
+
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр kaspi')['poster_supplier_id'] == 2
+    finally:
+        for alias in db.get_supplier_aliases(TEST_USER_ID):
+            if alias['alias_text'].startswith('тестовый сыр'):
+                db.delete_supplier_alias(TEST_USER_ID, alias['id'])
+
+
+def test_get_supplier_by_alias_caches_miss_until_alias_added(db):
+    """An unknown name resolves to None until an alias for it is added"""
+    assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр') is None
+    assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр') is None
+
+    db.add_supplier_alias(TEST_USER_ID, 'тестовый сыр', 1, 'ИП Сыр')
+    try:
+        assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр')['poster_supplier_id'] == 1
+    finally:
+        for alias in db.get_supplier_aliases(TEST_USER_ID):
+            if alias['alias_text'] == 'тестовый сыр':
+                db.delete_supplier_alias(TEST_USER_ID, alias['id'])
+
+    assert db.get_supplier_by_alias(TEST_USER_ID, 'тестовый сыр') is None
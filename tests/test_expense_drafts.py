@@ -0,0 +1,71 @@
+"""Tests for expense draft batch operations"""
+from tests.conftest import TEST_USER_ID
+
+MARKER = 'bulk-test'
+
+
+def _cleanup(db):
+    drafts = db.get_expense_drafts(TEST_USER_ID, status="all")
+    db.delete_expense_drafts_bulk(
+        [d['id'] for d in drafts if MARKER in (d.get('description') or '')],
+        telegram_user_id=TEST_USER_ID
+    )
+
+
+def test_create_expense_drafts_bulk(db):
+    """Synced Poster transactions are stored with their fields in one call"""
+    db.create_user(TEST_USER_ID, "mock_token", "1", "https://mock.joinposter.com/api")
+    _cleanup(db)
+    try:
+        created = db.create_expense_drafts_bulk(TEST_USER_ID, [
+            dict(amount=1500, description=f'{MARKER} такси', category='Транспорт', source='kaspi',
+                 poster_account_id=1, poster_transaction_id='1_501',
+                 completion_status='completed', poster_amount=1500),
+            dict(amount=20000, description=f'{MARKER} продажа масла', is_income=True,
+                 poster_account_id=1, poster_transaction_id='1_502'),
+        ])
+
+        assert created == 2
+        drafts = {d['poster_transaction_id']: d
+                  for d in db.get_expense_drafts(TEST_USER_ID, status="all")
+                  if MARKER in (d.get('description') or '')}
+        assert drafts['1_501']['source'] == 'kaspi'
+        assert drafts['1_501']['completion_status'] == 'completed'
+        assert drafts['1_502']['is_income'] == 1
+        assert drafts['1_502']['completion_status'] == 'pending'
+        assert db.create_expense_drafts_bulk(TEST_USER_ID, []) == 0
+    finally:
+        _cleanup(db)
+
+
+def test_get_expense_draft_sees_update(db):
+    """Writes invalidate the cached draft"""
+    db.create_user(TEST_USER_ID, "mock_token", "1", "https://mock.joinposter.com/api")
+    draft_id = db.create_expense_draft(TEST_USER_ID, amount=100, description=f'{MARKER} кэш')
+    try:
+        assert db.get_expense_draft(draft_id)['amount'] == 100
+
+        db.update_expense_draft(draft_id, amount=250)
+        assert db.get_expense_draft(draft_id)['amount'] == 250
+
+        db.mark_drafts_processed([draft_id])
+        assert db.get_expense_draft(draft_id)['status'] == 'processed'
+
+        db.delete_expense_draft(draft_id)
+        assert db.get_expense_draft(draft_id) is None
+    finally:
+        _cleanup(db)
+
+
+def test_get_pending_supply_items_sees_new_supply_expense(db):
+    """An empty result is remembered only until the user adds an expense draft"""
+    db.create_user(TEST_USER_ID, "mock_token", "1", "https://mock.joinposter.com/api")
+    _cleanup(db)
+    try:
+        assert not [d for d in db.get_pending_supply_items(TEST_USER_ID) if MARKER in d['description']]
+
+        db.create_expense_draft(TEST_USER_ID, amount=300, description=f'{MARKER} поставка', expense_type='supply')
+
+        assert [d['amount'] for d in db.get_pending_supply_items(TEST_USER_ID) if MARKER in d['description']] == [300]
+    finally:
+        _cleanup(db)
@@ -0,0 +1,82 @@
+"""Tests for subscription expiry"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+from database import DB_TYPE, UserDatabase, _q
+
+SUBSCRIPTION_TEST_USER_ID = 999997
+
+
+@pytest.fixture(autouse=True)
+def subscription_test_user(db):
+    """Create a throwaway user before each test and remove it afterwards"""
+    db.delete_user(SUBSCRIPTION_TEST_USER_ID)
+    db.create_user(SUBSCRIPTION_TEST_USER_ID, "token", "poster_user")
+    yield
+    db.delete_user(SUBSCRIPTION_TEST_USER_ID)
+
+
+@pytest.fixture
+def expiry_db(tmp_path, monkeypatch):
+    """A throwaway SQLite database holding only the test user.
+
+    expire_subscriptions updates every user in the table, so it must not
+    run against the shared database.
+    """
+    if DB_TYPE != "sqlite":
+        pytest.skip("expire_subscriptions tests need a throwaway SQLite database")
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "users.db")
+    expiry_db = UserDatabase()
+    expiry_db.create_user(SUBSCRIPTION_TEST_USER_ID, "token", "poster_user")
+    return expiry_db
+
+
+def _set_expires_at(db, expires_at):
+    """Backdate the test user's expiry directly (update_user has no such field).
+
+    A string is stored as-is, to mimic other writers' formats.
+    """
+    if DB_TYPE == "sqlite" and isinstance(expires_at, datetime):
+        expires_at = expires_at.isoformat()
+    conn = db._get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        _q("UPDATE users SET subscription_expires_at = ? WHERE telegram_user_id = ?"),
+        (expires_at, SUBSCRIPTION_TEST_USER_ID)
+    )
+    conn.commit()
+    conn.close()
+    db._user_cache.invalidate(SUBSCRIPTION_TEST_USER_ID)
+
+
+def test_active_trial(db):
+    """A fresh trial is active"""
+    assert db.is_subscription_active(SUBSCRIPTION_TEST_USER_ID) is True
+
+
+def test_expired_subscription(db):
+    """A past expiry date makes the check fail without writing to the row"""
+    _set_expires_at(db, datetime.now() - timedelta(days=1))
+
+    assert db.is_subscription_active(SUBSCRIPTION_TEST_USER_ID) is False
+    assert db.get_user(SUBSCRIPTION_TEST_USER_ID)['subscription_status'] == 'trial'
+
+
+def test_expire_subscriptions(expiry_db):
+    """expire_subscriptions flips the stored status of lapsed users"""
+    _set_expires_at(expiry_db, datetime.now() - timedelta(days=1))
+    expiry_db.get_user(SUBSCRIPTION_TEST_USER_ID)
+
+    assert expiry_db.expire_subscriptions() == 1
+    assert expiry_db.get_user(SUBSCRIPTION_TEST_USER_ID)['subscription_status'] == 'expired'
+
+
+def test_expire_subscriptions_space_separated_expiry(expiry_db):
+    """A same-day expiry written as '%Y-%m-%d %H:%M:%S' (activate_subscription.py) is not lapsed yet"""
+    later_today = datetime.now().replace(hour=23, minute=59, second=59, microsecond=0)
+    _set_expires_at(expiry_db, later_today.strftime('%Y-%m-%d %H:%M:%S'))
+
+    assert expiry_db.expire_subscriptions() == 0
+    assert expiry_db.get_user(SUBSCRIPTION_TEST_USER_ID)['subscription_status'] == 'trial'
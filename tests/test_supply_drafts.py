@@ -0,0 +1,86 @@
+"""Tests for supply draft reads"""
+import pytest
+
+from tests.conftest import TEST_USER_ID
+
+
+@pytest.fixture
+def two_drafts(db):
+    """Two supply drafts with items, removed after the test"""
+    db.create_user(TEST_USER_ID, "mock_token", "1", "https://mock.joinposter.com/api")
+    first = db.save_supply_draft(TEST_USER_ID, "Тест поставщик 1", "2026-01-01", [
+        {'name': 'Сыр', 'quantity': 2, 'unit': 'кг', 'price': 100},
+        {'name': 'Соус', 'quantity': 1, 'unit': 'шт', 'price': 50},
+    ])
+    second = db.save_supply_draft(TEST_USER_ID, "Тест поставщик 2", "2026-01-01", [
+        {'name': 'Лаваш', 'quantity': 10, 'unit': 'шт', 'price': 30},
+    ])
+    yield first, second
+    db.delete_supply_draft(first, telegram_user_id=TEST_USER_ID)
+    db.delete_supply_draft(second, telegram_user_id=TEST_USER_ID)
+
+
+def test_get_supply_drafts_with_items(db, two_drafts):
+    """Bulk fetch returns each draft with its own items in insertion order"""
+    first, second = two_drafts
+
+    drafts = db.get_supply_drafts_with_items([first, second, -1])
+
+    assert set(drafts) == {first, second}
+    assert [i['item_name'] for i in drafts[first]['items']] == ['Сыр', 'Соус']
+    assert [i['item_name'] for i in drafts[second]['items']] == ['Лаваш']
+    assert drafts[first]['items'][0]['total'] == 200
+
+
+def test_get_supply_draft_with_items_single(db, two_drafts):
+    """The single-draft lookup matches the bulk one and returns None for unknown ids"""
+    first, _ = two_drafts
+
+    draft = db.get_supply_draft_with_items(first)
+
+    assert draft['supplier_name'] == "Тест поставщик 1"
+    assert len(draft['items']) == 2
+    assert db.get_supply_draft_with_items(-1) is None
+    assert db.get_supply_drafts_with_items([]) == {}
+
+
+def test_mark_supply_draft_processed_marks_linked_expense(db):
+    """The linked expense draft is processed together with the supply draft"""
+    db.create_user(TEST_USER_ID, "mock_token", "1", "https://mock.joinposter.com/api")
+    expense_id = db.create_expense_draft(TEST_USER_ID, amount=100, description="Тест поставка", expense_type="supply")
+    supply_id = db.save_supply_draft(TEST_USER_ID, "Тест поставщик", "2026-01-01", [],
+                                     linked_expense_draft_id=expense_id)
+    try:
+        assert db.mark_supply_draft_processed(supply_id, expense_id)
+
+        assert db.get_supply_draft_with_items(supply_id)['status'] == 'processed'
+        assert db.get_expense_draft(expense_id)['status'] == 'processed'
+    finally:
+        db.delete_supply_draft(supply_id, telegram_user_id=TEST_USER_ID)
+        db.delete_expense_draft(expense_id, telegram_user_id=TEST_USER_ID)
+
+
+def test_get_supply_draft_with_items_sees_item_writes(db, two_drafts):
+    """Item and draft writes invalidate the cached draft"""
+    first, _ = two_drafts
+    assert len(db.get_supply_draft_with_items(first)['items']) == 2
+
+    item_id = db.add_supply_draft_item(first, item_name='Лук', quantity=1, price_per_unit=10)
+    assert len(db.get_supply_draft_with_items(first)['items']) == 3
+
+    db.update_supply_draft_item(item_id, item_name='Лук репчатый')
+    assert db.get_supply_draft_with_items(first)['items'][-1]['item_name'] == 'Лук репчатый'
+
+    db.update_supply_draft(first, supplier_name="Тест поставщик 1б")
+    assert db.get_supply_draft_with_items(first)['supplier_name'] == "Тест поставщик 1б"
+
+
+def test_mark_supply_drafts_processed_batch(db, two_drafts):
+    """Several drafts are marked processed in one call"""
+    first, second = two_drafts
+
+    assert db.mark_supply_drafts_processed([first, second]) == 2
+
+    drafts = db.get_supply_drafts_with_items([first, second])
+    assert {d['status'] for d in drafts.values()} == {'processed'}
+    assert db.mark_supply_drafts_processed([]) == 0
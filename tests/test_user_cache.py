@@ -0,0 +1,39 @@
+"""Tests for the cached get_user lookup"""
+import pytest
+
+CACHE_TEST_USER_ID = 999998
+
+
+@pytest.fixture(autouse=True)
+def cache_test_user(db):
+    """Create a throwaway user before each test and remove it afterwards"""
+    db.delete_user(CACHE_TEST_USER_ID)
+    db.create_user(CACHE_TEST_USER_ID, "token", "poster_user")
+    yield
+    db.delete_user(CACHE_TEST_USER_ID)
+
+
+def test_get_user_sees_update(db):
+    """update_user invalidates the cached row"""
+    assert db.get_user(CACHE_TEST_USER_ID)['subscription_status'] == 'trial'
+
+    db.update_user(CACHE_TEST_USER_ID, subscription_status='active')
+
+    assert db.get_user(CACHE_TEST_USER_ID)['subscription_status'] == 'active'
+
+
+def test_get_user_sees_delete(db):
+    """delete_user invalidates the cached row"""
+    assert db.get_user(CACHE_TEST_USER_ID) is not None
+
+    db.delete_user(CACHE_TEST_USER_ID)
+
+    assert db.get_user(CACHE_TEST_USER_ID) is None
+
+
+def test_get_user_returns_copy(db):
+    """Mutating a returned dict doesn't leak into later lookups"""
+    user = db.get_user(CACHE_TEST_USER_ID)
+    user['subscription_status'] = 'mutated'
+
+    assert db.get_user(CACHE_TEST_USER_ID)['subscription_status'] == 'trial'
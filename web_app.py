@@ -9,6 +9,7 @@ import asyncio
 import logging
 import time as _time
 import pytz
+from contextlib import closing
 from pathlib import Path
 from urllib.parse import parse_qsl
 from datetime import datetime
@@ -947,7 +948,7 @@ def api_create_alias(validated=None):
     """Create new alias for Mini App"""
     db = get_database()
 
-    success = db.add_ingredient_alias(
+    alias_id = db.add_ingredient_alias(
         telegram_user_id=g.user_id,
         alias_text=validated.alias_text,
         poster_item_id=validated.poster_item_id,
@@ -956,8 +957,8 @@ def api_create_alias(validated=None):
         notes=validated.notes,
     )
 
-    if success:
-        return jsonify({'success': True})
+    if alias_id:
+        return jsonify({'success': True, 'id': alias_id})
     else:
         return jsonify({'error': 'Failed to create alias'}), 500
 
@@ -1179,25 +1180,30 @@ def api_last_supply(supplier_id):
 
     # Get recent price history from this supplier
     try:
-        recent_items = db.get_price_history(
+        # Records stream newest first (sorted by date DESC), so the latest
+        # supply is within the leading run of the most recent date
+        recent_items = []
+        with closing(db.iter_price_history(
             telegram_user_id=g.user_id,
             supplier_id=supplier_id
-        )
+        )) as records:
+            for record in records:
+                if recent_items and record.get('date') != recent_items[0].get('date'):
+                    break
+                recent_items.append(record)
 
         items = []
         if recent_items:
-            # The first record is the most recent one (sorted by date DESC)
+            # The first record is the most recent one
             latest_record = recent_items[0]
             latest_supply_id = latest_record.get('supply_id')
-            latest_date = latest_record.get('date')
 
-            filtered_records = []
             if latest_supply_id:
                 # Filter by the same supply_id
                 filtered_records = [r for r in recent_items if r.get('supply_id') == latest_supply_id]
             else:
-                # Filter by the same date
-                filtered_records = [r for r in recent_items if r.get('date') == latest_date]
+                # Same date
+                filtered_records = recent_items
 
             # Group by item and get details
             items_dict = {}
@@ -1229,15 +1235,14 @@ def api_item_price_history(item_id):
     supplier_id = request.args.get('supplier_id', type=int)
 
     try:
+        # Last 10 records
         history = db.get_price_history(
             telegram_user_id=g.user_id,
             ingredient_id=item_id,
-            supplier_id=supplier_id
+            supplier_id=supplier_id,
+            limit=10
         )
 
-        # Limit to last 10 records
-        history = history[:10] if len(history) > 10 else history
-
         return jsonify({
             'item_id': item_id,
             'history': history
@@ -1861,12 +1866,11 @@ def view_assistant():
 
     # Load supply drafts for date
     all_supply_drafts = db.get_supply_drafts(g.user_id, status="pending")
+    day_supply_drafts = [sd for sd in all_supply_drafts if get_date_in_kz_tz(sd.get('created_at'), KZ_TZ) == selected_date]
+    supply_drafts_by_id = db.get_supply_drafts_with_items(sd['id'] for sd in day_supply_drafts)
     supply_drafts = []
-    for sd in all_supply_drafts:
-        created_date = get_date_in_kz_tz(sd.get('created_at'), KZ_TZ)
-        if created_date != selected_date:
-            continue
-        sd_with_items = db.get_supply_draft_with_items(sd['id'])
+    for sd in day_supply_drafts:
+        sd_with_items = supply_drafts_by_id.get(sd['id'])
         if sd_with_items:
             if 'items' in sd_with_items:
                 for item in sd_with_items['items']:
@@ -2249,12 +2253,11 @@ def _api_assistant_message_impl():
     
     # Reload supply drafts
     all_supply_drafts = db.get_supply_drafts(user_id, status="pending")
+    day_supply_drafts = [sd for sd in all_supply_drafts if get_date_in_kz_tz(sd.get('created_at'), KZ_TZ) == date_str]
+    supply_drafts_by_id = db.get_supply_drafts_with_items(sd['id'] for sd in day_supply_drafts)
     supply_drafts = []
-    for sd in all_supply_drafts:
-        created_date = get_date_in_kz_tz(sd.get('created_at'), KZ_TZ)
-        if created_date != date_str:
-            continue
-        sd_with_items = db.get_supply_draft_with_items(sd['id'])
+    for sd in day_supply_drafts:
+        sd_with_items = supply_drafts_by_id.get(sd['id'])
         if sd_with_items:
             if 'items' in sd_with_items:
                 for item in sd_with_items['items']:
@@ -2688,6 +2691,8 @@ def sync_expenses_from_poster():
                     logger.info(f"Fetched {len(transactions)} transactions for {date_str} from {account['account_name']}")
                     account_map = {str(acc['account_id']): acc for acc in finance_accounts}
 
+                    # New drafts are inserted in one batch after the loop
+                    new_drafts = []
                     for txn in transactions:
                         # Accept both expense (type=0) and income (type=1) transactions
                         # Skip transfers (type=2)
@@ -2823,8 +2828,7 @@ def sync_expenses_from_poster():
                         logger.debug(f"   -> source detected: {source}, is_income: {is_income}")
 
                         # Create draft - mark as 'completed' since it's already in Poster
-                        draft_id = db.create_expense_draft(
-                            telegram_user_id=g.user_id,
+                        new_drafts.append(dict(
                             amount=amount,
                             description=description,
                             expense_type='transaction',
@@ -2836,12 +2840,11 @@ def sync_expenses_from_poster():
                             is_income=is_income,
                             completion_status='completed',
                             poster_amount=amount
-                        )
+                        ))
+                        txn_type_label = "income" if is_income else "expense"
+                        logger.info(f"✅ Syncing {txn_type_label} #{txn_id} from {account['account_name']}: {description} - {amount}₸")
 
-                        if draft_id:
-                            synced_count += 1
-                            txn_type_label = "income" if is_income else "expense"
-                            logger.info(f"✅ Synced {txn_type_label} #{txn_id} from {account['account_name']}: {description} - {amount}₸")
+                    synced_count += db.create_expense_drafts_bulk(g.user_id, new_drafts)
 
                     # Mark account as successfully synced ONLY after all transactions processed
                     synced_account_ids.add(str(account['id']))
@@ -3952,6 +3955,8 @@ def api_sync_expenses_from_poster():
                     for acc in finance_accounts:
                         logger.info(f"  - account_id={acc.get('account_id')}, name='{acc.get('account_name') or acc.get('name')}'")
 
+                    # New drafts are inserted in one batch after the loop
+                    new_drafts = []
                     for idx, txn in enumerate(transactions):
                         # Debug: log first transaction structure
                         if idx == 0:
@@ -4081,8 +4086,7 @@ def api_sync_expenses_from_poster():
                         logger.debug(f"[SYNC] txn={txn_id}, finance_acc_name='{finance_acc_name}', source='{source}'")
 
                         # Create expense draft
-                        db.create_expense_draft(
-                            telegram_user_id=g.user_id,
+                        new_drafts.append(dict(
                             amount=amount,
                             description=description,
                             expense_type='transaction',
@@ -4094,8 +4098,9 @@ def api_sync_expenses_from_poster():
                             is_income=(txn_type == '1'),
                             completion_status='completed',
                             poster_amount=amount
-                        )
-                        synced += 1
+                        ))
+
+                    synced += db.create_expense_drafts_bulk(g.user_id, new_drafts)
 
                     # Mark account as successfully synced ONLY after all transactions processed
                     synced_account_ids.add(str(account['id']))
@@ -4349,14 +4354,12 @@ def api_get_supply_drafts():
     today = _kz_now().strftime("%Y-%m-%d")
 
     # Load items for each draft and linked expense amount
+    # (filter by today's date: created_at is converted from UTC to Kazakhstan time)
+    drafts_raw = [d for d in drafts_raw if get_date_in_kz_tz(d.get('created_at'), kz_tz) == today]
+    drafts_by_id = db.get_supply_drafts_with_items(d['id'] for d in drafts_raw)
     drafts = []
     for draft_raw in drafts_raw:
-        # Filter by today's date (convert created_at from UTC to Kazakhstan time)
-        created_date = get_date_in_kz_tz(draft_raw.get('created_at'), kz_tz)
-        if created_date != today:
-            continue
-
-        draft = db.get_supply_draft_with_items(draft_raw['id'])
+        draft = drafts_by_id.get(draft_raw['id'])
         if draft:
             # Map database column names to frontend expected names
             if 'items' in draft:
@@ -4845,14 +4848,12 @@ def list_supplies():
     today = _kz_now().strftime("%Y-%m-%d")
 
     # Load items for each draft and linked expense amount
+    # (filter by today's date: created_at is converted from UTC to Kazakhstan time)
+    drafts_raw = [d for d in drafts_raw if get_date_in_kz_tz(d.get('created_at'), kz_tz) == today]
+    drafts_by_id = db.get_supply_drafts_with_items(d['id'] for d in drafts_raw)
     drafts = []
     for draft_raw in drafts_raw:
-        # Filter by today's date (convert created_at from UTC to Kazakhstan time)
-        created_date = get_date_in_kz_tz(draft_raw.get('created_at'), kz_tz)
-        if created_date != today:
-            continue
-
-        draft = db.get_supply_draft_with_items(draft_raw['id'])
+        draft = drafts_by_id.get(draft_raw['id'])
         if draft:
             # Map database column names to frontend expected names
             if 'items' in draft:
@@ -4979,9 +4980,10 @@ def view_all_supplies():
     drafts_raw = db.get_supply_drafts(g.user_id, status="pending")
 
     # Load items for each draft
+    drafts_by_id = db.get_supply_drafts_with_items(d['id'] for d in drafts_raw)
     drafts = []
     for draft_raw in drafts_raw:
-        draft = db.get_supply_draft_with_items(draft_raw['id'])
+        draft = drafts_by_id.get(draft_raw['id'])
         if draft:
             # Map database column names to frontend expected names
             if 'items' in draft:
@@ -5182,11 +5184,12 @@ def process_all_supplies():
     db = get_database()
     drafts_raw = db.get_supply_drafts(g.user_id, status="pending")
 
+    drafts_by_id = db.get_supply_drafts_with_items(d['id'] for d in drafts_raw)
     results = []
     errors = []
 
     for draft_raw in drafts_raw:
-        draft = db.get_supply_draft_with_items(draft_raw['id'])
+        draft = drafts_by_id.get(draft_raw['id'])
         if not draft:
             continue
 
@@ -5309,11 +5312,8 @@ def process_all_supplies():
                         'account': account.get('name', '')
                     })
 
-            # Mark draft as processed
-            db.mark_supply_draft_processed(draft['id'])
-
-            if draft.get('linked_expense_draft_id'):
-                db.mark_drafts_processed([draft['linked_expense_draft_id']])
+            # Mark draft (and its linked expense draft) as processed
+            db.mark_supply_draft_processed(draft['id'], draft.get('linked_expense_draft_id'))
 
         except Exception as e:
             import traceback
@@ -8129,6 +8129,7 @@ def _sync_expenses_for_user(db, sync_user_id):
                             _cache_set(cache_key, finance_accounts)
                         account_map = {str(acc['account_id']): acc for acc in finance_accounts}
 
+                        new_drafts = []
                         for txn in transactions:
                             txn_type = str(txn.get('type'))
                             category_name = txn.get('name', '') or txn.get('category_name', '')
@@ -8215,8 +8216,7 @@ def _sync_expenses_for_user(db, sync_user_id):
                             elif 'халык' in finance_acc_name or 'halyk' in finance_acc_name:
                                 source = 'halyk'
 
-                            db.create_expense_draft(
-                                telegram_user_id=sync_user_id,
+                            new_drafts.append(dict(
                                 amount=amount,
                                 description=description,
                                 expense_type='transaction',
@@ -8228,8 +8228,9 @@ def _sync_expenses_for_user(db, sync_user_id):
                                 is_income=(txn_type == '1'),
                                 completion_status='completed',
                                 poster_amount=amount
-                            )
-                            synced += 1
+                            ))
+
+                        synced += db.create_expense_drafts_bulk(sync_user_id, new_drafts)
 
                         synced_account_ids.add(str(account['id']))
                     finally:
@@ -8975,8 +8976,9 @@ def whatsapp_webhook():
             active_drafts = [d for d in all_drafts if d.get('created_at') and get_date_in_kz_tz(d['created_at'], KZ_TZ) == date_str]
             
             all_supply_drafts = db.get_supply_drafts(user_id, status="pending")
+            supply_drafts_by_id = db.get_supply_drafts_with_items(sd['id'] for sd in all_supply_drafts)
             for sd in all_supply_drafts:
-                sd_with_items = db.get_supply_draft_with_items(sd['id'])
+                sd_with_items = supply_drafts_by_id.get(sd['id'])
                 if sd_with_items:
                     active_drafts.append({
                         'id': sd['id'],